@@ -1,8 +1,1558 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import time
 import random
 import sqlite3
+import math
+import csv
+import heapq
+import json
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from multiprocessing import shared_memory
+
+# 點位重複判定距離（X/Y/Z 為 mm，C 為 °）
+DUPLICATE_TOLERANCE = 0.01
+
+# 程式執行時序：每行間隔，以及移動時間模型（每 1 mm 或 1° 花費 0.1 秒，最小 0.5 秒）
+LINE_INTERVAL_MS = 1000
+MOVE_TIME_PER_UNIT = 0.1
+MIN_MOVE_TIME = 0.5
+MOTION_FRAME_MS = 16  # 移動時每一畫面更新一次坐標
+WAITIN_POLL_MS = 20   # WAITIN 檢查 INPUT 狀態的間隔
+UI_FRAME_MS = 16      # 介面狀態變更每一畫面最多套用一次
+
+AXES = ("X", "Y", "Z", "C")
+
+# 程式語言（關鍵字不分大小寫，# 或 ; 之後為註解）：
+#   MOVE <座標運算式>          移動到點位或坐標，例如 MOVE P1、MOVE Base + Pitch * i、MOVE P1 + (0, 0, 10, 0)
+#   MOVE X=<值> Y=<值> ...     移動到指定坐標（未指定的軸維持不變）
+#   OUT <元件名稱> ON|OFF      設定 OUTPUT 狀態
+#   WAIT <秒>                  延遲
+#   WAITIN <元件名稱> [ON|OFF] 等待 INPUT 狀態
+#   SET <變數> = <運算式>      設定變數（變數預設為 0）
+#   LOOP <次數> ... END        重複執行
+#   FOR <變數> = <起> TO <迄> [STEP <間隔>] ... END
+#   WHILE <條件> ... END
+#   IF <條件> ... [ELSE ...] END
+#   SUB <名稱> ... END         定義副程式，以 CALL <名稱> 呼叫
+# 條件可使用 IN <元件名稱>（INPUT 為 ON）、比較運算 < <= > >= == != 以及 AND、OR、NOT
+# 運算式中的名稱若為變數則取變數值，否則為點位坐標 (x, y, z, c)
+PROGRAM_COMMANDS = ("MOVE", "OUT", "WAIT", "WAITIN", "SET", "LOOP", "FOR", "WHILE", "IF", "ELSE", "END", "SUB", "CALL")
+RESERVED_WORDS = ("IN", "NOT", "AND", "OR", "TO", "STEP", "ON", "OFF")
+TOKEN_PATTERN = re.compile(r"\s*(?:(?P<comment>[#;].*)|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+                           r"|(?P<name>[^\W\d]\w*)|(?P<op><=|>=|==|!=|<>|[-+*/(),=<>])|(?P<error>\S))")
+VARIABLE_PATTERN = re.compile(r"^[ \t]*(?:SET|FOR)[ \t]+([^\W\d]\w*)", re.IGNORECASE | re.MULTILINE)
+MAX_CALL_DEPTH = 256
+
+# 位元組碼指令（運算元直接接在指令之後）
+(OP_CONST, OP_LOAD, OP_STORE, OP_POINT,
+ OP_ADD, OP_SUB, OP_MUL, OP_DIV,
+ OP_LT, OP_LE, OP_GT, OP_GE, OP_EQ, OP_NE,
+ OP_JUMP, OP_JUMP_IF_FALSE, OP_LOOP_TEST, OP_FOR_TEST,
+ OP_MOVE, OP_MOVE_AXES, OP_OUT, OP_WAIT, OP_WAITIN,
+ OP_INPUT, OP_NOT, OP_NEG, OP_AND, OP_OR, OP_VEC, OP_CALL, OP_RET, OP_HALT) = range(32)
+COMPARE_OPS = {"<": "<", "<=": "<=", ">": ">", ">=": ">=", "==": "==", "!=": "!=", "<>": "!="}
+BINARY_OPCODES = {"+": OP_ADD, "-": OP_SUB, "*": OP_MUL, "/": OP_DIV,
+                  "<": OP_LT, "<=": OP_LE, ">": OP_GT, ">=": OP_GE, "==": OP_EQ, "!=": OP_NE,
+                  "AND": OP_AND, "OR": OP_OR}
+
+# 執行剖析：標示為最耗時的行所佔比例、熱度欄寬度 (像素)
+PROFILE_TOP_FRACTION = 0.05
+PROFILE_GUTTER_WIDTH = 44
+
+# 時序紀錄：取樣間隔、紀錄檔目錄
+RECORD_INTERVAL_MS = 50
+RECORD_FLUSH_SECONDS = 2.0  # 最多每隔幾秒寫入一次紀錄檔，異常結束時最多遺失這段時間的資料
+RECORD_DIR = "records"
+
+# I/O 位元編號：OUTPUT 為 2 × number，INPUT 為 2 × number + 1（number 為 io 表格的編號），
+# 編號相同的 INPUT 和 OUTPUT（例如 X1/Y1）不會共用同一個位元
+def io_bit_number(is_input, number):
+    return 2 * number + (1 if is_input else 0)
+
+
+# 紀錄檔格式（小端序）：
+#   檔頭: 識別碼 C300TSR1, I/O 字數 (uint32), I/O 名稱 JSON 長度 (uint32), I/O 名稱 JSON {位元編號: 名稱}
+#   區塊: 識別碼 CHNK, 筆數 n (uint32), 起始時間 (double), 結束時間 (double),
+#         時間[n], X[n], Y[n], Z[n], C[n] (double), I/O 位元[n * I/O 字數] (uint64)
+RECORD_MAGIC = b"C300TSR1"
+RECORD_HEADER = struct.Struct("<8sII")
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("<4sIdd")
+
+# 共享記憶體機台狀態區塊（小端序，固定配置，共 112 bytes）：
+#   0   識別碼 C300SHM1 (8s), 配置版本 (uint32), 寫入端 PID (uint32，0 表示沒有寫入端)
+#   16  序號 (uint64)：寫入中為奇數，寫入完成為偶數
+#   24  X, Y, Z, C (double)
+#   56  運行狀態 (uint8: 0 停止, 1 運行, 2 暫停), 操作模式 (uint8: 0 手動, 1 自動),
+#       執行模式 (uint8: 0 連續, 1 單節), 保留 (uint8)
+#   60  當前行數 (uint32), 總行數 (uint32), 保留 (4 bytes)
+#   72  更新時間 (double, time.time())
+#   80  I/O 位元 (256 bits，位元編號見 io_bit_number：OUTPUT 為 2 × number，INPUT 為 2 × number + 1，
+#       因此只能容納編號 0~127 的 I/O)
+# 讀取端：先讀序號，若為奇數則重試；讀取內容後再讀一次序號，兩次相同才是完整的資料
+SHARED_STATE_NAME = "c300_machine_state"
+SHARED_STATE_MAGIC = b"C300SHM1"
+SHARED_STATE_VERSION = 2
+SHARED_STATE_HEADER = struct.Struct("<8sII")
+SHARED_STATE_SEQ = struct.Struct("<Q")
+SHARED_STATE_BODY = struct.Struct("<4dBBBxII4xd32s")
+SHARED_STATE_SEQ_OFFSET = 16
+SHARED_STATE_BODY_OFFSET = 24
+SHARED_STATE_SIZE = SHARED_STATE_BODY_OFFSET + SHARED_STATE_BODY.size
+SHARED_STATE_IO_BITS = 256
+
+
+class PointIndex:
+    # 點位空間索引：以 k-d 樹索引 point 表格的 X/Y/Z/C 四軸坐標
+    # 新增與修改的點先放入待併入區，刪除與修改的舊位置以過期標記處理，累積過多時才重建整棵樹
+    def __init__(self, rebuild_ratio=0.25, min_pending=256):
+        self.rebuild_ratio = rebuild_ratio
+        self.min_pending = min_pending
+        self.points = {}    # 所有點位：名稱 -> (x, y, z, c)
+        self.tree = None    # k-d 樹節點：[名稱, 坐標, 分割軸, 左子樹, 右子樹]
+        self.tree_size = 0
+        self.pending = {}   # 尚未併入 k-d 樹的點位
+        self.stale = set()  # 仍在 k-d 樹中但已刪除或修改的點位名稱
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, name):
+        return name in self.points
+
+    def build(self, rows):
+        # 以 (名稱, x, y, z, c) 資料列重建整個索引
+        self.points = {row[0]: tuple(float(v) for v in row[1:5]) for row in rows}
+        self.rebuild()
+
+    def rebuild(self):
+        items = list(self.points.items())
+        self.tree = self._build_node(items, 0)
+        self.tree_size = len(items)
+        self.pending = {}
+        self.stale = set()
+
+    def _build_node(self, items, depth):
+        if not items:
+            return None
+        axis = depth % 4
+        items.sort(key=lambda item: item[1][axis])
+        mid = len(items) // 2
+        name, coords = items[mid]
+        return [name, coords, axis,
+                self._build_node(items[:mid], depth + 1),
+                self._build_node(items[mid + 1:], depth + 1)]
+
+    def add(self, name, coords):
+        # 新增或修改點位
+        if name in self.points and name not in self.pending:
+            self.stale.add(name)
+        self.points[name] = tuple(float(v) for v in coords)
+        self.pending[name] = self.points[name]
+        self._maybe_rebuild()
+
+    def remove(self, name):
+        # 刪除點位
+        if name not in self.points:
+            return
+        del self.points[name]
+        if self.pending.pop(name, None) is None:
+            self.stale.add(name)
+        self._maybe_rebuild()
+
+    def _maybe_rebuild(self):
+        if len(self.pending) + len(self.stale) > max(self.min_pending, self.tree_size * self.rebuild_ratio):
+            self.rebuild()
+
+    def nearest(self, coords, exclude=None):
+        # 查詢最接近的點位，回傳 (名稱, 距離)；沒有點位時回傳 (None, None)
+        target = tuple(float(v) for v in coords)
+        best = [None, math.inf]
+        for name, point in self.pending.items():
+            if name != exclude:
+                dist_sq = _distance_sq(point, target)
+                if dist_sq < best[1]:
+                    best[0], best[1] = name, dist_sq
+        self._nearest_node(self.tree, target, exclude, best)
+        if best[0] is None:
+            return None, None
+        return best[0], math.sqrt(best[1])
+
+    def _nearest_node(self, node, target, exclude, best):
+        while node is not None:
+            name, point, axis, left, right = node
+            if name != exclude and name not in self.stale:
+                dist_sq = _distance_sq(point, target)
+                if dist_sq < best[1]:
+                    best[0], best[1] = name, dist_sq
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            # 先搜尋同側子樹，另一側只有在分割面距離小於目前最佳距離時才需要搜尋
+            self._nearest_node(near, target, exclude, best)
+            if diff * diff >= best[1]:
+                return
+            node = far
+
+    def within(self, coords, radius):
+        # 查詢半徑範圍內的所有點位，回傳依距離排序的 [(名稱, 距離), ...]
+        target = tuple(float(v) for v in coords)
+        radius_sq = radius * radius
+        found = []
+        for name, point in self.pending.items():
+            dist_sq = _distance_sq(point, target)
+            if dist_sq <= radius_sq:
+                found.append((name, dist_sq))
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            name, point, axis, left, right = node
+            if name not in self.stale:
+                dist_sq = _distance_sq(point, target)
+                if dist_sq <= radius_sq:
+                    found.append((name, dist_sq))
+            diff = target[axis] - point[axis]
+            if diff <= radius:
+                stack.append(left)
+            if diff >= -radius:
+                stack.append(right)
+        found.sort(key=lambda item: item[1])
+        return [(name, math.sqrt(dist_sq)) for name, dist_sq in found]
+
+    def duplicates(self, coords, tolerance=DUPLICATE_TOLERANCE):
+        # 查詢與指定坐標重複（距離在容許誤差內）的點位名稱
+        return [name for name, _ in self.within(coords, tolerance)]
+
+
+def _distance_sq(a, b):
+    dx = a[0] - b[0]
+    dy = a[1] - b[1]
+    dz = a[2] - b[2]
+    dc = a[3] - b[3]
+    return dx * dx + dy * dy + dz * dz + dc * dc
+
+
+def move_time_between(start, target):
+    # 依移動模型計算兩組坐標 (x, y, z, c) 之間的移動時間（秒）
+    total_distance = sum(abs(t - s) for s, t in zip(start, target))
+    return max(total_distance * MOVE_TIME_PER_UNIT, MIN_MOVE_TIME)
+
+
+class ProgramError(Exception):
+    # 程式編譯或執行錯誤，line_no 為發生錯誤的程式行號
+    def __init__(self, line_no, message):
+        super().__init__(f"第 {line_no} 行: {message}")
+        self.line_no = line_no
+        self.message = message
+
+
+def lex_program_line(line):
+    # 將一行程式切分為 [(種類, 文字, 起始欄, 結束欄), ...]
+    # 種類：number, name, op, comment（# 或 ; 之後的內容）, error（無法辨識的字元）
+    tokens = []
+    pos = 0
+    length = len(line)
+    while pos < length:
+        match = TOKEN_PATTERN.match(line, pos)
+        if match is None:
+            break
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "comment":
+            tokens.append(("comment", match.group(kind), match.start(kind), length))
+            break
+        if kind is not None:
+            tokens.append((kind, match.group(kind), match.start(kind), pos))
+    return tokens
+
+
+class _StatementParser:
+    # 單行敘述的遞迴下降語法分析，輸出巢狀 tuple 形式的語法樹
+    def __init__(self, tokens):
+        self.tokens = [token for token in tokens if token[0] != "comment"]
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("敘述不完整")
+        if token[0] == "error":
+            raise ValueError(f"無法辨識的字元 '{token[1]}'")
+        self.pos += 1
+        return token
+
+    def at_op(self, op):
+        token = self.peek()
+        return token is not None and token[0] == "op" and token[1] == op
+
+    def at_word(self, word):
+        token = self.peek()
+        return token is not None and token[0] == "name" and token[1].upper() == word
+
+    def expect_op(self, op):
+        token = self.next()
+        if token[0] != "op" or token[1] != op:
+            raise ValueError(f"預期 '{op}'，但得到 '{token[1]}'")
+
+    def expect_word(self, word):
+        token = self.next()
+        if token[0] != "name" or token[1].upper() != word:
+            raise ValueError(f"預期 {word}，但得到 '{token[1]}'")
+
+    def expect_name(self):
+        token = self.next()
+        if token[0] != "name" or token[1].upper() in RESERVED_WORDS:
+            raise ValueError(f"預期名稱，但得到 '{token[1]}'")
+        return token[1]
+
+    def expect_state(self):
+        # ON/OFF，省略時為 ON
+        if self.peek() is None:
+            return True
+        token = self.next()
+        if token[0] != "name" or token[1].upper() not in ("ON", "OFF"):
+            raise ValueError(f"預期 ON 或 OFF，但得到 '{token[1]}'")
+        return token[1].upper() == "ON"
+
+    def finish(self):
+        token = self.peek()
+        if token is not None:
+            raise ValueError(f"多餘的內容 '{token[1]}'")
+
+    def parse_statement(self):
+        token = self.peek()
+        if token is None:
+            return None
+        if token[0] != "name":
+            raise ValueError(f"未知的指令 '{token[1]}'")
+        command = token[1].upper()
+        if command not in PROGRAM_COMMANDS:
+            raise ValueError(f"未知的指令 '{token[1]}'")
+        self.pos += 1
+
+        if command == "MOVE":
+            token = self.peek()
+            following = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else None
+            if token is not None and token[0] == "name" and token[1].upper() in AXES and following is not None and following[1] == "=":
+                axes = {}
+                while self.peek() is not None:
+                    axis = self.next()
+                    if axis[0] != "name" or axis[1].upper() not in AXES:
+                        raise ValueError(f"預期軸名稱 X/Y/Z/C，但得到 '{axis[1]}'")
+                    if axis[1].upper() in axes:
+                        raise ValueError(f"重複指定 {axis[1].upper()} 軸")
+                    self.expect_op("=")
+                    axes[axis[1].upper()] = self.parse_expression()
+                statement = ("MOVE_AXES", axes)
+            else:
+                statement = ("MOVE", self.parse_expression())
+        elif command in ("OUT", "WAITIN"):
+            statement = (command, self.expect_name(), self.expect_state())
+        elif command in ("WAIT", "LOOP", "WHILE", "IF"):
+            statement = (command, self.parse_expression())
+        elif command == "SET":
+            name = self.expect_name()
+            self.expect_op("=")
+            statement = ("SET", name, self.parse_expression())
+        elif command == "FOR":
+            name = self.expect_name()
+            self.expect_op("=")
+            start = self.parse_expression()
+            self.expect_word("TO")
+            end = self.parse_expression()
+            step = ("num", 1.0)
+            if self.at_word("STEP"):
+                self.pos += 1
+                step = self.parse_expression()
+            statement = ("FOR", name, start, end, step)
+        elif command in ("SUB", "CALL"):
+            statement = (command, self.expect_name())
+        else:
+            # ELSE / END
+            statement = (command,)
+        self.finish()
+        return statement
+
+    # 運算式優先順序：OR < AND < NOT < 比較 < 加減 < 乘除 < 正負號
+    def parse_expression(self):
+        node = self.parse_and()
+        while self.at_word("OR"):
+            self.pos += 1
+            node = ("bin", "OR", node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.at_word("AND"):
+            self.pos += 1
+            node = ("bin", "AND", node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.at_word("NOT"):
+            self.pos += 1
+            return ("not", self.parse_not())
+        node = self.parse_sum()
+        token = self.peek()
+        if token is not None and token[0] == "op" and token[1] in COMPARE_OPS:
+            self.pos += 1
+            node = ("bin", COMPARE_OPS[token[1]], node, self.parse_sum())
+        return node
+
+    def parse_sum(self):
+        node = self.parse_product()
+        while self.at_op("+") or self.at_op("-"):
+            op = self.next()[1]
+            node = ("bin", op, node, self.parse_product())
+        return node
+
+    def parse_product(self):
+        node = self.parse_unary()
+        while self.at_op("*") or self.at_op("/"):
+            op = self.next()[1]
+            node = ("bin", op, node, self.parse_unary())
+        return node
+
+    def parse_unary(self):
+        if self.at_op("-"):
+            self.pos += 1
+            return ("neg", self.parse_unary())
+        if self.at_op("+"):
+            self.pos += 1
+            return self.parse_unary()
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.next()
+        kind, text = token[0], token[1]
+        if kind == "number":
+            return ("num", float(text))
+        if kind == "name":
+            if text.upper() == "IN":
+                return ("in", self.expect_name())
+            if text.upper() in RESERVED_WORDS:
+                raise ValueError(f"'{text}' 不能用在運算式中")
+            return ("name", text)
+        if text == "(":
+            items = [self.parse_expression()]
+            while self.at_op(","):
+                self.pos += 1
+                items.append(self.parse_expression())
+            self.expect_op(")")
+            if len(items) == 1:
+                return items[0]
+            if len(items) != 4:
+                raise ValueError("坐標必須為 (X, Y, Z, C) 四個數值")
+            return ("vec", items)
+        raise ValueError(f"運算式中不能出現 '{text}'")
+
+
+def parse_program_statement(line):
+    # 解析一行程式，回傳語法樹；空白行和註解回傳 None，語法錯誤時拋出 ValueError
+    return _StatementParser(lex_program_line(line)).parse_statement()
+
+
+class Program:
+    # 編譯後的程式：位元組碼、每個位元組碼位置對應的程式行號、常數表、名稱表
+    def __init__(self, code, line_map, consts, names, var_names, line_count):
+        self.code = code
+        self.line_map = line_map
+        self.consts = consts
+        self.names = names
+        self.var_names = var_names
+        self.line_count = line_count
+
+
+class ProgramCompiler:
+    # 將程式編譯為位元組碼；points/outputs/inputs 不為 None 時會檢查名稱是否存在
+    def __init__(self, points=None, outputs=None, inputs=None):
+        self.points = points
+        self.outputs = outputs
+        self.inputs = inputs
+
+    def compile(self, lines):
+        # 第一遍：解析每一行（相同內容只解析一次），並收集 SET/FOR 定義的變數
+        statements = []
+        parsed_cache = {}
+        variables = {}
+        for line_no, line in enumerate(lines, 1):
+            statement = parsed_cache.get(line, parsed_cache)
+            if statement is parsed_cache:
+                try:
+                    statement = parse_program_statement(line)
+                except ValueError as e:
+                    raise ProgramError(line_no, str(e))
+                parsed_cache[line] = statement
+            statements.append(statement)
+            if statement is not None and statement[0] in ("SET", "FOR") and statement[1] not in variables:
+                variables[statement[1]] = len(variables)
+
+        # 第二遍：產生位元組碼
+        self.code = []
+        self.line_map = array("l")
+        self.consts = []
+        self.const_index = {}
+        self.names = []
+        self.name_index = {}
+        self.variables = variables
+        self.var_names = list(variables)
+        subs = {}
+        calls = []
+        blocks = []
+        for line_no, statement in enumerate(statements, 1):
+            if statement is None:
+                continue
+            self.line_no = line_no
+            kind = statement[0]
+            if kind == "MOVE":
+                self.emit_expression(statement[1])
+                self.emit(OP_MOVE)
+            elif kind == "MOVE_AXES":
+                mask = 0
+                for bit, axis in enumerate(AXES):
+                    if axis in statement[1]:
+                        self.emit_expression(statement[1][axis])
+                        mask |= 1 << bit
+                self.emit(OP_MOVE_AXES, mask)
+            elif kind == "OUT":
+                self.check_name(statement[1], self.outputs, "OUTPUT 元件")
+                self.emit(OP_OUT, self.name_slot(statement[1]), int(statement[2]))
+            elif kind == "WAITIN":
+                self.check_name(statement[1], self.inputs, "INPUT 元件")
+                self.emit(OP_WAITIN, self.name_slot(statement[1]), int(statement[2]))
+            elif kind == "WAIT":
+                self.emit_expression(statement[1])
+                self.emit(OP_WAIT)
+            elif kind == "SET":
+                self.emit_expression(statement[2])
+                self.emit(OP_STORE, variables[statement[1]])
+            elif kind == "LOOP":
+                counter = self.hidden_variable()
+                self.emit_expression(statement[1])
+                self.emit(OP_STORE, counter)
+                start = len(self.code)
+                self.emit(OP_LOOP_TEST, counter, -1)
+                blocks.append({"kind": kind, "line": line_no, "start": start, "patch": len(self.code) - 1})
+            elif kind == "FOR":
+                _, name, start_expr, end_expr, step_expr = statement
+                end_slot = self.hidden_variable()
+                step_slot = self.hidden_variable()
+                self.emit_expression(start_expr)
+                self.emit(OP_STORE, variables[name])
+                self.emit_expression(end_expr)
+                self.emit(OP_STORE, end_slot)
+                self.emit_expression(step_expr)
+                self.emit(OP_STORE, step_slot)
+                start = len(self.code)
+                self.emit(OP_FOR_TEST, variables[name], end_slot, step_slot, -1)
+                blocks.append({"kind": kind, "line": line_no, "start": start, "patch": len(self.code) - 1,
+                               "variable": variables[name], "step": step_slot})
+            elif kind == "WHILE":
+                start = len(self.code)
+                self.emit_expression(statement[1])
+                self.emit(OP_JUMP_IF_FALSE, -1)
+                blocks.append({"kind": kind, "line": line_no, "start": start, "patch": len(self.code) - 1})
+            elif kind == "IF":
+                self.emit_expression(statement[1])
+                self.emit(OP_JUMP_IF_FALSE, -1)
+                blocks.append({"kind": kind, "line": line_no, "patch": len(self.code) - 1, "else": False})
+            elif kind == "ELSE":
+                if not blocks or blocks[-1]["kind"] != "IF" or blocks[-1]["else"]:
+                    raise ProgramError(line_no, "ELSE 沒有對應的 IF")
+                block = blocks[-1]
+                self.emit(OP_JUMP, -1)
+                self.code[block["patch"]] = len(self.code)
+                block["patch"] = len(self.code) - 1
+                block["else"] = True
+            elif kind == "SUB":
+                if blocks:
+                    raise ProgramError(line_no, "SUB 不能定義在其他區塊內")
+                if statement[1] in subs:
+                    raise ProgramError(line_no, f"副程式 '{statement[1]}' 重複定義")
+                # 依序執行時跳過副程式本體
+                self.emit(OP_JUMP, -1)
+                subs[statement[1]] = len(self.code)
+                blocks.append({"kind": kind, "line": line_no, "patch": len(self.code) - 1})
+            elif kind == "CALL":
+                self.emit(OP_CALL, -1)
+                calls.append((len(self.code) - 1, statement[1], line_no))
+            elif kind == "END":
+                if not blocks:
+                    raise ProgramError(line_no, "END 沒有對應的區塊")
+                block = blocks.pop()
+                if block["kind"] == "FOR":
+                    self.emit(OP_LOAD, block["variable"], OP_LOAD, block["step"], OP_ADD, OP_STORE, block["variable"])
+                if block["kind"] in ("LOOP", "FOR", "WHILE"):
+                    self.emit(OP_JUMP, block["start"])
+                elif block["kind"] == "SUB":
+                    self.emit(OP_RET)
+                self.code[block["patch"]] = len(self.code)
+
+        if blocks:
+            raise ProgramError(blocks[-1]["line"], f"{blocks[-1]['kind']} 缺少對應的 END")
+        self.line_no = len(statements)
+        self.emit(OP_HALT)
+        for position, name, line_no in calls:
+            if name not in subs:
+                raise ProgramError(line_no, f"未定義的副程式 '{name}'")
+            self.code[position] = subs[name]
+        return Program(self.code, self.line_map, self.consts, self.names, self.var_names, len(statements))
+
+    def emit(self, *values):
+        self.code.extend(values)
+        self.line_map.extend([self.line_no] * len(values))
+
+    def const_slot(self, value):
+        slot = self.const_index.get(value)
+        if slot is None:
+            slot = self.const_index[value] = len(self.consts)
+            self.consts.append(value)
+        return slot
+
+    def name_slot(self, name):
+        slot = self.name_index.get(name)
+        if slot is None:
+            slot = self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return slot
+
+    def hidden_variable(self):
+        # 迴圈計數用的內部變數（名稱以 # 開頭，程式中無法使用）
+        self.var_names.append(f"#{len(self.var_names)}")
+        return len(self.var_names) - 1
+
+    def check_name(self, name, known, description):
+        if known is not None and name not in known:
+            raise ProgramError(self.line_no, f"未定義的{description} '{name}'")
+
+    def emit_expression(self, node):
+        kind = node[0]
+        if kind == "num":
+            self.emit(OP_CONST, self.const_slot(node[1]))
+        elif kind == "name":
+            name = node[1]
+            if name in self.variables:
+                self.emit(OP_LOAD, self.variables[name])
+            else:
+                self.check_name(name, self.points, "點位或變數")
+                self.emit(OP_POINT, self.name_slot(name))
+        elif kind == "vec":
+            for item in node[1]:
+                self.emit_expression(item)
+            self.emit(OP_VEC)
+        elif kind == "neg":
+            self.emit_expression(node[1])
+            self.emit(OP_NEG)
+        elif kind == "not":
+            self.emit_expression(node[1])
+            self.emit(OP_NOT)
+        elif kind == "in":
+            self.check_name(node[1], self.inputs, "INPUT 元件")
+            self.emit(OP_INPUT, self.name_slot(node[1]))
+        else:
+            self.emit_expression(node[2])
+            self.emit_expression(node[3])
+            self.emit(BINARY_OPCODES[node[1]])
+
+
+def _vector_op(op, a, b):
+    # 數值與坐標 (x, y, z, c) 的四則運算
+    a_vector = isinstance(a, tuple)
+    b_vector = isinstance(b, tuple)
+    if not a_vector and not b_vector:
+        if op == OP_ADD:
+            return a + b
+        if op == OP_SUB:
+            return a - b
+        if op == OP_MUL:
+            return a * b
+        return a / b
+    if op in (OP_ADD, OP_SUB):
+        if not (a_vector and b_vector):
+            raise TypeError("坐標只能與坐標相加減")
+        if op == OP_ADD:
+            return (a[0] + b[0], a[1] + b[1], a[2] + b[2], a[3] + b[3])
+        return (a[0] - b[0], a[1] - b[1], a[2] - b[2], a[3] - b[3])
+    if op == OP_MUL and a_vector != b_vector:
+        vector, scale = (a, b) if a_vector else (b, a)
+        return (vector[0] * scale, vector[1] * scale, vector[2] * scale, vector[3] * scale)
+    if op == OP_DIV and a_vector and not b_vector:
+        return (a[0] / b, a[1] / b, a[2] / b, a[3] / b)
+    raise TypeError("坐標不支援此運算")
+
+
+def _compare_op(op, a, b):
+    if isinstance(a, tuple) or isinstance(b, tuple):
+        if op in (OP_EQ, OP_NE):
+            return float((a == b) == (op == OP_EQ))
+        raise TypeError("坐標無法比較大小")
+    if op == OP_LT:
+        return float(a < b)
+    if op == OP_LE:
+        return float(a <= b)
+    if op == OP_GT:
+        return float(a > b)
+    if op == OP_GE:
+        return float(a >= b)
+    if op == OP_EQ:
+        return float(a == b)
+    return float(a != b)
+
+
+class ProgramVM:
+    # 位元組碼虛擬機
+    # step() 執行到下一個動作指令 (MOVE/OUT/WAIT/WAITIN) 就回傳 (動作, 參數, 行號)，由呼叫端完成動作後再呼叫 step()
+    def __init__(self, program, points, read_input):
+        self.program = program
+        self.points = points          # 點位名稱 -> (x, y, z, c)，執行時查詢
+        self.read_input = read_input  # INPUT 名稱 -> 狀態
+        self.pc = 0
+        self.stack = []
+        self.calls = []
+        self.vars = [0.0] * len(program.var_names)
+
+    def step(self, max_ops=100000):
+        # 程式結束時回傳 (None, None, 行號)；超過 max_ops 仍未遇到動作時回傳 ("YIELD", None, 行號)，避免長時間佔用
+        program = self.program
+        code = program.code
+        consts = program.consts
+        names = program.names
+        stack = self.stack
+        variables = self.vars
+        pc = self.pc
+        try:
+            for _ in range(max_ops):
+                op = code[pc]
+                if op == OP_CONST:
+                    stack.append(consts[code[pc + 1]])
+                    pc += 2
+                elif op == OP_LOAD:
+                    stack.append(variables[code[pc + 1]])
+                    pc += 2
+                elif op == OP_STORE:
+                    variables[code[pc + 1]] = stack.pop()
+                    pc += 2
+                elif op == OP_POINT:
+                    point = self.points.get(names[code[pc + 1]])
+                    if point is None:
+                        raise ProgramError(program.line_map[pc], f"未定義的點位 '{names[code[pc + 1]]}'")
+                    stack.append(point)
+                    pc += 2
+                elif op <= OP_DIV:
+                    b = stack.pop()
+                    stack.append(_vector_op(op, stack.pop(), b))
+                    pc += 1
+                elif op <= OP_NE:
+                    b = stack.pop()
+                    stack.append(_compare_op(op, stack.pop(), b))
+                    pc += 1
+                elif op == OP_JUMP:
+                    pc = code[pc + 1]
+                elif op == OP_JUMP_IF_FALSE:
+                    pc = pc + 2 if stack.pop() else code[pc + 1]
+                elif op == OP_LOOP_TEST:
+                    slot = code[pc + 1]
+                    if variables[slot] >= 1:
+                        variables[slot] -= 1
+                        pc += 3
+                    else:
+                        pc = code[pc + 2]
+                elif op == OP_FOR_TEST:
+                    value = variables[code[pc + 1]]
+                    end = variables[code[pc + 2]]
+                    if (value > end) if variables[code[pc + 3]] >= 0 else (value < end):
+                        pc = code[pc + 4]
+                    else:
+                        pc += 5
+                elif op == OP_MOVE:
+                    target = stack.pop()
+                    if not isinstance(target, tuple):
+                        raise ProgramError(program.line_map[pc], "MOVE 的目標必須是點位或坐標")
+                    self.pc = pc + 1
+                    return "MOVE", target, program.line_map[pc]
+                elif op == OP_MOVE_AXES:
+                    mask = code[pc + 1]
+                    target = [None, None, None, None]
+                    for bit in (3, 2, 1, 0):
+                        if mask & (1 << bit):
+                            target[bit] = stack.pop()
+                            if isinstance(target[bit], tuple):
+                                raise ProgramError(program.line_map[pc], f"{AXES[bit]} 軸的目標必須是數值")
+                    self.pc = pc + 2
+                    return "MOVE", tuple(target), program.line_map[pc]
+                elif op == OP_OUT:
+                    self.pc = pc + 3
+                    return "OUT", (names[code[pc + 1]], bool(code[pc + 2])), program.line_map[pc]
+                elif op == OP_WAIT:
+                    seconds = stack.pop()
+                    if isinstance(seconds, tuple) or seconds < 0:
+                        raise ProgramError(program.line_map[pc], "WAIT 秒數必須是非負數值")
+                    self.pc = pc + 1
+                    return "WAIT", seconds, program.line_map[pc]
+                elif op == OP_WAITIN:
+                    self.pc = pc + 3
+                    return "WAITIN", (names[code[pc + 1]], bool(code[pc + 2])), program.line_map[pc]
+                elif op == OP_INPUT:
+                    stack.append(float(bool(self.read_input(names[code[pc + 1]]))))
+                    pc += 2
+                elif op == OP_NOT:
+                    stack.append(float(not stack.pop()))
+                    pc += 1
+                elif op == OP_NEG:
+                    value = stack.pop()
+                    stack.append(tuple(-v for v in value) if isinstance(value, tuple) else -value)
+                    pc += 1
+                elif op == OP_AND:
+                    b = stack.pop()
+                    stack.append(float(bool(stack.pop()) and bool(b)))
+                    pc += 1
+                elif op == OP_OR:
+                    b = stack.pop()
+                    stack.append(float(bool(stack.pop()) or bool(b)))
+                    pc += 1
+                elif op == OP_VEC:
+                    vector = tuple(stack[-4:])
+                    del stack[-4:]
+                    if any(isinstance(v, tuple) for v in vector):
+                        raise ProgramError(program.line_map[pc], "坐標的各軸必須是數值")
+                    stack.append(vector)
+                    pc += 1
+                elif op == OP_CALL:
+                    if len(self.calls) >= MAX_CALL_DEPTH:
+                        raise ProgramError(program.line_map[pc], "副程式呼叫層數過多")
+                    self.calls.append(pc + 2)
+                    pc = code[pc + 1]
+                elif op == OP_RET:
+                    pc = self.calls.pop()
+                else:
+                    # OP_HALT
+                    self.pc = pc
+                    return None, None, program.line_map[pc]
+        except (TypeError, ZeroDivisionError) as e:
+            self.pc = pc
+            raise ProgramError(program.line_map[pc], f"運算錯誤: {e}")
+        self.pc = pc
+        return "YIELD", None, program.line_map[pc]
+
+
+def tokenize_program_line(line):
+    # 將一行程式切分為語法單元（用於語法上色），回傳 [(種類, 起始欄, 結束欄), ...]
+    # 種類：comment, command, keyword, unknown, name, variable, sub, output, input, axis, number, state, invalid
+    tokens = lex_program_line(line)
+    if not tokens:
+        return []
+    try:
+        parse_program_statement(line)
+    except ValueError:
+        # 語法錯誤：整行標示為錯誤（保留行尾註解）
+        end = tokens[-2][3] if tokens[-1][0] == "comment" and len(tokens) > 1 else tokens[-1][3]
+        spans = [("invalid", tokens[0][2], end)]
+        if tokens[-1][0] == "comment" and len(tokens) > 1:
+            spans.append(("comment", tokens[-1][2], tokens[-1][3]))
+        return spans
+
+    spans = []
+    command = tokens[0][1].upper() if tokens[0][0] == "name" else None
+    previous = None
+    for position, (kind, text, start, end) in enumerate(tokens):
+        upper = text.upper()
+        if kind == "comment":
+            spans.append(("comment", start, end))
+        elif kind == "number":
+            spans.append(("number", start, end))
+        elif kind == "name":
+            following = tokens[position + 1] if position + 1 < len(tokens) else None
+            if position == 0:
+                spans.append(("command", start, end))
+            elif position == 1 and command in ("OUT", "WAITIN"):
+                spans.append(("output" if command == "OUT" else "input", start, end))
+            elif position == 1 and command in ("SUB", "CALL"):
+                spans.append(("sub", start, end))
+            elif position == 1 and command in ("SET", "FOR"):
+                spans.append(("variable", start, end))
+            elif previous == "IN":
+                spans.append(("input", start, end))
+            elif upper in RESERVED_WORDS:
+                spans.append(("state" if upper in ("ON", "OFF") else "keyword", start, end))
+            elif command == "MOVE" and upper in AXES and following is not None and following[1] == "=":
+                spans.append(("axis", start, end))
+            else:
+                spans.append(("name", start, end))
+        previous = upper if kind == "name" else None
+    return spans
+
+
+class ProgramHighlighter:
+    # 程式編輯器的增量語法上色與錯誤標示
+    # 攔截 Text 元件的 insert/delete/replace，將被編輯的行加上 _dirty 標籤（標籤會隨文字移動），
+    # 閒置時只重新分析「可見範圍內」且帶有 _dirty 標籤的行
+    TAG_STYLES = {
+        "syn_command": {"foreground": "#4FC3F7"},
+        "syn_name": {"foreground": "#FFD54F"},
+        "syn_variable": {"foreground": "#80CBC4"},
+        "syn_axis": {"foreground": "#CE93D8"},
+        "syn_number": {"foreground": "#F48FB1"},
+        "syn_state": {"foreground": "#FFB74D"},
+        "syn_comment": {"foreground": "#90A4AE"},
+        "syn_error": {"foreground": "#FF5252", "underline": True},
+        "syn_undefined": {"foreground": "#FF8A65", "underline": True},
+    }
+    TOKEN_TAGS = {
+        "command": "syn_command", "keyword": "syn_command", "name": "syn_name", "output": "syn_name", "input": "syn_name",
+        "variable": "syn_variable", "sub": "syn_variable", "axis": "syn_axis", "number": "syn_number",
+        "state": "syn_state", "comment": "syn_comment", "invalid": "syn_error",
+    }
+
+    def __init__(self, text, name_sets):
+        self.text = text
+        self.name_sets = name_sets  # 回傳 {"point": 點位名稱, "output": ..., "input": ...} 的函式
+        self.variables = set()      # 程式中以 SET/FOR 定義的變數
+        self.cache = {}             # 行內容 -> 上色範圍
+        self.names = None
+        self.job = None
+        self.edit_count = 0         # 編輯次數（供其他元件判斷內容是否已變更）
+        self.on_edit = None         # 每次編輯後呼叫的函式
+        for tag, options in self.TAG_STYLES.items():
+            text.tag_configure(tag, **options)
+
+        # 將 Text 元件的 Tcl 指令改名，由 _dispatch 代理，以得知每次編輯的範圍
+        self.orig = text._w + "_orig"
+        text.tk.call("rename", text._w, self.orig)
+        text.tk.createcommand(text._w, self._dispatch)
+        text.bind("<Configure>", lambda event: self.schedule(), add="+")
+
+    def _dispatch(self, operation, *args):
+        call = self.text.tk.call
+        if operation not in ("insert", "delete", "replace"):
+            return call((self.orig, operation) + args)
+        # Tk 會把 end 之後的位置限制在最後一個換行字元之前（例如 insert end 會插入到最後一行），行號需同樣限制
+        text_last_line = int(call(self.orig, "index", "end -1c").split(".")[0])
+
+        def line_of(index):
+            return min(int(call(self.orig, "index", index).split(".")[0]), text_last_line)
+
+        start_line = line_of(args[0])
+        # 編輯前受影響各行中的變數定義（刪除或改名時需要重新掃描）
+        if operation == "insert":
+            indices = args[:1]
+        elif operation == "replace":
+            indices = args[:2]
+        else:
+            indices = args
+        old_last_line = max(line_of(index) for index in indices)
+        old_defs = VARIABLE_PATTERN.findall(call(self.orig, "get", f"{start_line}.0", f"{old_last_line}.end"))
+        result = call((self.orig, operation) + args)
+        self.edit_count += 1
+        if operation == "insert":
+            inserted = "".join(args[1::2])
+        elif operation == "replace":
+            inserted = "".join(args[2::2])
+        else:
+            inserted = ""
+        end_line = start_line + inserted.count("\n")
+        new_defs = VARIABLE_PATTERN.findall(call(self.orig, "get", f"{start_line}.0", f"{end_line}.end"))
+        if new_defs != old_defs:
+            # 變數定義被新增、刪除或改名：重新掃描變數，所有行都需要重新檢查
+            self.names = None
+            self.invalidate()
+        call(self.orig, "tag", "add", "_dirty", f"{start_line}.0", f"{end_line}.end +1c")
+        self.schedule()
+        if self.on_edit is not None:
+            self.on_edit()
+        return result
+
+    def invalidate(self):
+        # 點位、I/O 或變數名稱變更時，所有行都需要重新檢查
+        self.cache.clear()
+        self.text.tag_add("_dirty", "1.0", tk.END)
+        self.schedule()
+
+    def schedule(self):
+        if self.job is None:
+            self.job = self.text.after_idle(self.highlight_visible)
+
+    def highlight_visible(self):
+        # 只處理可見範圍內被標記為 _dirty 的行
+        self.job = None
+        text = self.text
+        if self.names is None:
+            self.names = self.name_sets()
+            self.variables = set(VARIABLE_PATTERN.findall(text.get("1.0", tk.END)))
+            self.cache.clear()
+        first = int(text.index("@0,0").split(".")[0])
+        last = int(text.index(f"@0,{text.winfo_height()}").split(".")[0])
+        index = f"{first}.0"
+        stop = f"{last}.end +1c"
+        while True:
+            dirty = text.tag_nextrange("_dirty", index, stop)
+            if not dirty:
+                break
+            start_line = int(dirty[0].split(".")[0])
+            end_line = min(int(text.index(f"{dirty[1]} -1c").split(".")[0]), last)
+            for line_no in range(start_line, end_line + 1):
+                self._highlight_line(line_no)
+            index = f"{end_line + 1}.0"
+
+    def on_scroll(self):
+        # 捲動後新出現的行可能尚未上色
+        self.schedule()
+
+    def _highlight_line(self, line_no):
+        text = self.text
+        line_start = f"{line_no}.0"
+        line_end = f"{line_no}.end"
+        line = text.get(line_start, line_end)
+        spans = self.cache.get(line)
+        if spans is None:
+            spans = []
+            for kind, start, end in tokenize_program_line(line):
+                tag = self.TOKEN_TAGS[kind]
+                name = line[start:end]
+                if kind == "variable" and name not in self.variables:
+                    # 新的變數定義：其他行中使用此變數的地方需要重新檢查
+                    self.variables.add(name)
+                    self.invalidate()
+                elif kind == "name" and name not in self.names["point"] and name not in self.variables:
+                    tag = "syn_undefined"
+                elif kind in ("output", "input") and name not in self.names[kind]:
+                    tag = "syn_undefined"
+                spans.append((tag, start, end))
+            if len(self.cache) > 10000:
+                self.cache.clear()
+            self.cache[line] = spans
+        for tag in self.TAG_STYLES:
+            text.tag_remove(tag, line_start, line_end)
+        for tag, start, end in spans:
+            text.tag_add(tag, f"{line_no}.{start}", f"{line_no}.{end}")
+        text.tag_remove("_dirty", line_start, f"{line_end} +1c")
+
+
+class ProgramSimulator:
+    # 程式模擬：以虛擬機台模型全速執行編譯後的程式，不經過 after() 延遲和介面更新
+    # 時間模型與實際執行相同：每個動作間隔 LINE_INTERVAL_MS，MOVE 另加移動時間，WAIT 另加延遲時間
+    def __init__(self, points, start_coords, input_states=None, input_wait=0.0, max_actions=5000000, max_yields=100):
+        self.points = points                        # 點位名稱 -> (x, y, z, c)
+        self.start_coords = tuple(start_coords)
+        self.input_states = dict(input_states or {})  # 模擬時的 INPUT 狀態（固定不變）
+        self.input_wait = input_wait                # INPUT 狀態不符時 WAITIN 的預估等待時間（秒）
+        self.max_actions = max_actions              # 動作數上限，避免無窮迴圈
+        self.max_yields = max_yields                # 兩個動作之間虛擬機讓出次數上限（每次 100000 個指令），避免沒有動作的無窮迴圈
+
+    def run(self, program):
+        # 執行模擬，回傳結果字典；line_times 為每一行程式累計的時間（迴圈中的行會累加）
+        line_interval = LINE_INTERVAL_MS / 1000.0
+        line_times = array("d", bytes(8 * program.line_count))
+        travel = [0.0, 0.0, 0.0, 0.0]
+        coords = list(self.start_coords)
+        errors = []
+        inputs = self.input_states
+        vm = ProgramVM(program, self.points, lambda name: inputs.get(name, False))
+        total_time = 0.0
+        actions = 0
+        yields = 0
+
+        while True:
+            try:
+                action, arg, line_no = vm.step()
+            except ProgramError as e:
+                errors.append((e.line_no, e.message))
+                break
+            if action is None:
+                break
+            if action == "YIELD":
+                yields += 1
+                if yields > self.max_yields:
+                    errors.append((line_no, f"運算量超過上限（{self.max_yields} × 100000 個指令），可能是無窮迴圈"))
+                    break
+                continue
+            yields = 0  # 只計算連續沒有動作的運算量
+            actions += 1
+            if actions > self.max_actions:
+                errors.append((line_no, f"動作數超過上限 {self.max_actions}，可能是無窮迴圈"))
+                break
+
+            line_time = line_interval
+            if action == "MOVE":
+                distance = 0.0
+                for i in range(4):
+                    target = arg[i]
+                    if target is not None:
+                        delta = abs(target - coords[i])
+                        travel[i] += delta
+                        distance += delta
+                        coords[i] = target
+                move_time = distance * MOVE_TIME_PER_UNIT
+                line_time += move_time if move_time > MIN_MOVE_TIME else MIN_MOVE_TIME
+            elif action == "WAIT":
+                line_time += arg
+            elif action == "WAITIN":
+                if inputs.get(arg[0], False) != arg[1]:
+                    line_time += self.input_wait
+            line_times[line_no - 1] += line_time
+            total_time += line_time
+
+        return {
+            "total_time": total_time,
+            "line_times": line_times,
+            "actions": actions,
+            "travel": dict(zip(AXES, travel)),
+            "final_coords": dict(zip(AXES, coords)),
+            "errors": errors,
+        }
+
+
+class LineProfiler:
+    # 逐行執行剖析：跨多次執行累計每個程式行的實際時間、移動時間與等待輸入時間
+    # 一行的實際時間從開始執行該行的動作到動作完成，不含行與行之間的間隔和暫停的時間
+    def __init__(self):
+        self.code_lines = None
+        self.runs = 0
+        self.reset(0)
+
+    def reset(self, line_count):
+        self.hits = array("Q", bytes(8 * line_count))
+        self.wall = array("d", bytes(8 * line_count))
+        self.motion = array("d", bytes(8 * line_count))
+        self.wait = array("d", bytes(8 * line_count))
+        self.runs = 0
+        self.total_wall = 0.0
+        self.max_wall = 0.0       # 單行最大累計時間（熱度比例的基準）
+        self.threshold = None     # 最耗時行的時間下限，每次執行結束時更新
+        self.line_no = 0          # 進行中的行（0 表示沒有）
+        self.segment_start = None  # 進行中的行本段開始計時的時間（暫停時為 None）
+        self.phase = None         # 進行中的階段：motion 或 wait
+        self.phase_start = 0.0
+
+    def begin_run(self, code_lines):
+        # 程式內容改變時重新累計（行號已不對應）
+        if code_lines != self.code_lines:
+            self.code_lines = list(code_lines)
+            self.reset(len(code_lines))
+        self.runs += 1
+
+    def begin_line(self, line_no):
+        self.end_line()
+        self.line_no = line_no
+        self.hits[line_no - 1] += 1
+        self.segment_start = time.perf_counter()
+
+    def begin_phase(self, phase):
+        if self.line_no:
+            self.phase = phase
+            self.phase_start = time.perf_counter()
+
+    def suspend(self):
+        # 暫停或動作完成：結算本段的時間
+        if not self.line_no or self.segment_start is None:
+            return
+        now = time.perf_counter()
+        index = self.line_no - 1
+        if self.phase == "motion":
+            self.motion[index] += now - self.phase_start
+        elif self.phase == "wait":
+            self.wait[index] += now - self.phase_start
+        self.phase = None
+        elapsed = now - self.segment_start
+        self.wall[index] += elapsed
+        self.total_wall += elapsed
+        if self.wall[index] > self.max_wall:
+            self.max_wall = self.wall[index]
+        self.segment_start = None
+
+    def resume(self):
+        if self.line_no and self.segment_start is None:
+            self.segment_start = time.perf_counter()
+
+    def end_line(self):
+        self.suspend()
+        self.line_no = 0
+
+    def finish_run(self):
+        self.end_line()
+        self.threshold = self.hot_threshold()
+
+    def hot_threshold(self):
+        # 最耗時的 PROFILE_TOP_FRACTION 行的時間下限；沒有資料時回傳 None
+        times = sorted((t for t in self.wall if t > 0.0), reverse=True)
+        if not times:
+            return None
+        return times[max(1, math.ceil(len(times) * PROFILE_TOP_FRACTION)) - 1]
+
+    def report_rows(self):
+        # 依實際時間由大到小排序的報告資料
+        total = self.total_wall
+        threshold = self.hot_threshold()
+        rows = []
+        for index in sorted(range(len(self.wall)), key=self.wall.__getitem__, reverse=True):
+            wall = self.wall[index]
+            hits = self.hits[index]
+            if not hits:
+                continue
+            motion = self.motion[index]
+            wait = self.wait[index]
+            rows.append({
+                "line_no": index + 1,
+                "code": self.code_lines[index],
+                "hits": hits,
+                "wall": wall,
+                "average": wall / hits,
+                "motion": motion,
+                "wait": wait,
+                "other": max(0.0, wall - motion - wait),
+                "percent": wall / total * 100.0 if total else 0.0,
+                "hot": threshold is not None and wall >= threshold,
+            })
+        return rows
+
+
+def heat_color(ratio):
+    # 熱度顏色：由深藍灰（冷）漸變到橘色（熱）
+    low, high = (0x37, 0x47, 0x4F), (0xFF, 0xB7, 0x4D)
+    return "#" + "".join(f"{round(a + (b - a) * ratio):02X}" for a, b in zip(low, high))
+
+
+class TimeSeriesRecorder:
+    # 坐標與 I/O 狀態的時序紀錄器
+    # 取樣寫入預先配置的環形緩衝區（固定記憶體），每累積 chunk_size 筆或經過 flush_seconds 秒就以區塊寫入紀錄檔
+    def __init__(self, file_path, io_names, capacity=8192, chunk_size=1024, flush_seconds=RECORD_FLUSH_SECONDS):
+        self.file_path = file_path
+        self.io_names = dict(io_names)  # 位元編號 -> 名稱
+        self.io_words = max(self.io_names) // 64 + 1 if self.io_names else 1
+        self.capacity = capacity
+        self.chunk_size = min(chunk_size, capacity)
+        self.flush_seconds = flush_seconds
+        self.flush_time = time.time()  # 上次寫入檔案的時間
+        self.times = array("d", bytes(8 * capacity))
+        self.columns = [array("d", bytes(8 * capacity)) for _ in AXES]
+        self.io = array("Q", bytes(8 * capacity * self.io_words))
+        self.total = 0     # 累計取樣筆數
+        self.flushed = 0   # 已寫入檔案的筆數
+        self.chunks = []   # 已寫入的區塊索引：(起始時間, 結束時間, 檔案位置, 筆數)
+
+        names = json.dumps({str(bit): name for bit, name in self.io_names.items()}, ensure_ascii=False).encode("utf-8")
+        self.file = open(file_path, "w+b")
+        self.file.write(RECORD_HEADER.pack(RECORD_MAGIC, self.io_words, len(names)))
+        self.file.write(names)
+        self.file.flush()
+
+    def sample(self, t, x, y, z, c, io_bits):
+        # 記錄一筆取樣（只寫入預先配置的陣列）
+        pos = self.total % self.capacity
+        self.times[pos] = t
+        columns = self.columns
+        columns[0][pos] = x
+        columns[1][pos] = y
+        columns[2][pos] = z
+        columns[3][pos] = c
+        if self.io_words == 1:
+            self.io[pos] = io_bits
+        else:
+            base = pos * self.io_words
+            for word in range(self.io_words):
+                self.io[base + word] = (io_bits >> (64 * word)) & 0xFFFFFFFFFFFFFFFF
+        self.total += 1
+        if self.total - self.flushed >= self.chunk_size or t - self.flush_time >= self.flush_seconds:
+            self.flush()
+
+    def _ring_slice(self, data, start, count, width=1):
+        # 取出環形緩衝區中從 start 開始的 count 筆資料（可能跨越尾端）
+        start_pos = start % self.capacity
+        end_pos = start_pos + count
+        if end_pos <= self.capacity:
+            return data[start_pos * width:end_pos * width]
+        return data[start_pos * width:] + data[:(end_pos - self.capacity) * width]
+
+    def flush(self):
+        # 將尚未寫入的取樣以一個區塊寫入紀錄檔
+        count = self.total - self.flushed
+        if count <= 0 or self.file is None:
+            return
+        times = self._ring_slice(self.times, self.flushed, count)
+        columns = [times] + [self._ring_slice(column, self.flushed, count) for column in self.columns]
+        columns.append(self._ring_slice(self.io, self.flushed, count, self.io_words))
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        self.file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, count, times[0], times[-1]))
+        for column in columns:
+            if sys.byteorder != "little":
+                column.byteswap()
+            column.tofile(self.file)
+        self.file.flush()
+        self.flush_time = times[-1]
+        self.chunks.append((times[0], times[-1], offset, count))
+        self.flushed = self.total
+
+    def query(self, start_time, end_time):
+        # 查詢時間範圍內的取樣，回傳 [(時間, X, Y, Z, C, I/O 位元), ...]
+        self.flush()
+        rows = []
+        for chunk_start, chunk_end, offset, count in self.chunks:
+            if chunk_end >= start_time and chunk_start <= end_time:
+                rows.extend(_read_record_chunk(self.file, offset, count, self.io_words, start_time, end_time))
+        return rows
+
+    def export_csv(self, file_path, start_time, end_time):
+        # 匯出時間範圍內的取樣為 CSV，回傳筆數
+        rows = self.query(start_time, end_time)
+        _write_record_csv(file_path, self.io_names, rows)
+        return len(rows)
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+def _read_record_chunk(file, offset, count, io_words, start_time, end_time):
+    # 讀取一個區塊，只回傳時間範圍內的取樣
+    file.seek(offset + CHUNK_HEADER.size)
+    columns = []
+    for _ in range(5):
+        column = array("d")
+        column.fromfile(file, count)
+        columns.append(column)
+    io = array("Q")
+    io.fromfile(file, count * io_words)
+    if sys.byteorder != "little":
+        for column in columns:
+            column.byteswap()
+        io.byteswap()
+
+    times = columns[0]
+    first = bisect_left(times, start_time)
+    last = bisect_right(times, end_time)
+    rows = []
+    for i in range(first, last):
+        if io_words == 1:
+            bits = io[i]
+        else:
+            bits = 0
+            for word in range(io_words):
+                bits |= io[i * io_words + word] << (64 * word)
+        rows.append((times[i], columns[1][i], columns[2][i], columns[3][i], columns[4][i], bits))
+    return rows
+
+
+def read_record_file(file_path, start_time=-math.inf, end_time=math.inf):
+    # 離線讀取紀錄檔，回傳 (I/O 名稱 {位元編號: 名稱}, 取樣列表)
+    with open(file_path, "rb") as file:
+        magic, io_words, names_length = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"不是有效的紀錄檔: {file_path}")
+        io_names = {int(bit): name for bit, name in json.loads(file.read(names_length).decode("utf-8")).items()}
+        # 依區塊檔頭跳躍掃描，只讀取時間範圍重疊的區塊
+        rows = []
+        offset = file.tell()
+        chunk_size_per_row = 8 * (5 + io_words)
+        while True:
+            file.seek(offset)
+            header = file.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                break
+            magic, count, chunk_start, chunk_end = CHUNK_HEADER.unpack(header)
+            if magic != CHUNK_MAGIC:
+                break
+            if chunk_end >= start_time and chunk_start <= end_time:
+                try:
+                    rows.extend(_read_record_chunk(file, offset, count, io_words, start_time, end_time))
+                except (EOFError, ValueError):
+                    # 最後一個區塊未完整寫入（例如程式異常結束），檔案長度可能不是 8 的倍數
+                    break
+            offset += CHUNK_HEADER.size + count * chunk_size_per_row
+    return io_names, rows
+
+
+def _write_record_csv(file_path, io_names, rows):
+    bits = sorted(io_names)
+    with open(file_path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["時間", "X", "Y", "Z", "C"] + [io_names[bit] for bit in bits])
+        for t, x, y, z, c, io_bits in rows:
+            writer.writerow([f"{t:.3f}", x, y, z, c] + [(io_bits >> bit) & 1 for bit in bits])
+
+
+def _process_alive(pid):
+    # 檢查程序是否仍在執行
+    if os.name == "posix":
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        return False
+    exit_code = ctypes.c_ulong()
+    try:
+        return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))) and exit_code.value == 259  # STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+class MachineStateBlock:
+    # 機台狀態共享記憶體（寫入端），以序號鎖 (sequence lock) 保護，外部程式可直接讀取
+    # 同一時間只能有一個寫入端；檔頭記錄寫入端 PID，另一個控制程式仍在執行時拒絕接管
+    def __init__(self, name=SHARED_STATE_NAME):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SHARED_STATE_SIZE)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=name)
+            owner = 0
+            if self.shm.size >= SHARED_STATE_HEADER.size:
+                magic, _, pid = SHARED_STATE_HEADER.unpack_from(self.shm.buf, 0)
+                if magic == SHARED_STATE_MAGIC:
+                    owner = pid
+            if owner and owner != os.getpid() and _process_alive(owner):
+                if os.name == "posix":
+                    # 不擁有此區塊，避免結束時被 resource_tracker 刪除
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister(self.shm._name, "shared_memory")
+                self.shm.close()
+                self.shm = None
+                raise FileExistsError(f"共享記憶體 {name} 正由另一個控制程式 (PID {owner}) 使用")
+            # 上次程式異常結束留下的區塊，大小足夠就直接沿用
+            if self.shm.size < SHARED_STATE_SIZE:
+                self.shm.close()
+                self.shm.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=SHARED_STATE_SIZE)
+        self.buf = self.shm.buf
+        self.sequence = 0
+        SHARED_STATE_SEQ.pack_into(self.buf, SHARED_STATE_SEQ_OFFSET, self.sequence)
+        SHARED_STATE_HEADER.pack_into(self.buf, 0, SHARED_STATE_MAGIC, SHARED_STATE_VERSION, os.getpid())
+
+    def publish(self, coords, run_state, operation_mode, execution_mode, current_line, total_lines, io_bits):
+        # 序號先變為奇數，寫入內容後再變為偶數
+        # 超出範圍的 I/O 已在啟動時警告（見 CNCControlInterface.start_state_block）
+        io_bits &= (1 << SHARED_STATE_IO_BITS) - 1
+        self.sequence += 1
+        SHARED_STATE_SEQ.pack_into(self.buf, SHARED_STATE_SEQ_OFFSET, self.sequence)
+        SHARED_STATE_BODY.pack_into(self.buf, SHARED_STATE_BODY_OFFSET,
+                                    coords[0], coords[1], coords[2], coords[3],
+                                    run_state, operation_mode, execution_mode,
+                                    current_line, total_lines, time.time(),
+                                    io_bits.to_bytes(SHARED_STATE_IO_BITS // 8, "little"))
+        self.sequence += 1
+        SHARED_STATE_SEQ.pack_into(self.buf, SHARED_STATE_SEQ_OFFSET, self.sequence)
+
+    def close(self):
+        if self.shm is not None:
+            # 只在區塊仍屬於本程式時清除寫入端 PID 並刪除區塊
+            owned = SHARED_STATE_HEADER.unpack_from(self.buf, 0)[2] == os.getpid()
+            if owned:
+                # Windows 上讀取端仍開啟時區塊不會被刪除，清除 PID 讓下次啟動可以接管
+                SHARED_STATE_HEADER.pack_into(self.buf, 0, SHARED_STATE_MAGIC, SHARED_STATE_VERSION, 0)
+            self.buf = None
+            self.shm.close()
+            if owned:
+                try:
+                    self.shm.unlink()
+                except FileNotFoundError:
+                    pass
+            self.shm = None
+
+
+class MachineStateReader:
+    # 機台狀態共享記憶體（讀取端），供外部程式（視覺、MES 等）輪詢使用
+    def __init__(self, name=SHARED_STATE_NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            # 讀取端不擁有此區塊，避免結束時被 resource_tracker 刪除
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        magic, version, _ = SHARED_STATE_HEADER.unpack_from(self.shm.buf, 0)
+        if magic != SHARED_STATE_MAGIC or version != SHARED_STATE_VERSION:
+            self.shm.close()
+            raise ValueError("共享記憶體配置不符")
+
+    def read(self, retries=1000):
+        # 讀取一份一致的狀態，回傳 dict；寫入端持續更新導致無法取得一致資料時拋出 TimeoutError
+        buf = self.shm.buf
+        for _ in range(retries):
+            before = SHARED_STATE_SEQ.unpack_from(buf, SHARED_STATE_SEQ_OFFSET)[0]
+            if before & 1:
+                continue
+            body = SHARED_STATE_BODY.unpack_from(buf, SHARED_STATE_BODY_OFFSET)
+            after = SHARED_STATE_SEQ.unpack_from(buf, SHARED_STATE_SEQ_OFFSET)[0]
+            if before == after:
+                x, y, z, c, run_state, operation_mode, execution_mode, current_line, total_lines, updated, io_bits = body
+                return {
+                    "sequence": before,
+                    "coords": {"X": x, "Y": y, "Z": z, "C": c},
+                    "run_state": run_state,
+                    "operation_mode": operation_mode,
+                    "execution_mode": execution_mode,
+                    "current_line": current_line,
+                    "total_lines": total_lines,
+                    "updated": updated,
+                    "io_bits": int.from_bytes(io_bits, "little"),
+                }
+        raise TimeoutError("無法讀取一致的機台狀態")
+
+    def close(self):
+        self.shm.close()
+
+
+class UIStateModel:
+    # 可觀察的介面狀態模型：set() 只記錄欄位值並將相依的繪製函式標記為 dirty，
+    # 每個畫面最多執行一次這些函式；函式透過 apply() 設定元件選項，
+    # 只有與已套用的值不同的選項才會呼叫 configure
+    def __init__(self, root):
+        self.root = root
+        self.values = {}    # 欄位 -> 值
+        self.watchers = {}  # 欄位 -> [繪製函式]
+        self.dirty = {}     # 待執行的繪製函式（保持順序並去除重複）
+        self.applied = {}   # 元件路徑 -> {選項: 已套用的值}
+        self.job = None
+
+    def watch(self, fields, callback):
+        for field in fields:
+            self.watchers.setdefault(field, []).append(callback)
+
+    def get(self, field, default=None):
+        return self.values.get(field, default)
+
+    def set(self, field, value):
+        if field in self.values and self.values[field] == value:
+            return
+        self.values[field] = value
+        for callback in self.watchers.get(field, ()):
+            self.dirty[callback] = None
+        if self.dirty and self.job is None:
+            self.job = self.root.after(UI_FRAME_MS, self.flush)
+
+    def flush(self):
+        # 執行所有 dirty 的繪製函式（也可直接呼叫以立即套用）
+        if self.job is not None:
+            self.root.after_cancel(self.job)
+            self.job = None
+        while self.dirty:
+            callbacks = list(self.dirty)
+            self.dirty.clear()
+            for callback in callbacks:
+                callback()
+
+    def apply(self, widget, **options):
+        applied = self.applied.setdefault(str(widget), {})
+        changes = {option: value for option, value in options.items() if applied.get(option) != value}
+        if changes:
+            widget.configure(**changes)
+            applied.update(changes)
+
 
 class CNCControlInterface:
     def __init__(self, root):
@@ -10,6 +1560,8 @@ class CNCControlInterface:
         self.root.title("CNC 四軸機械手臂控制")
         # 設置全螢幕
         self.root.attributes('-fullscreen', True)
+        # 視窗被關閉時也寫入紀錄檔並釋放共享記憶體
+        self.root.protocol("WM_DELETE_WINDOW", self.close_program)
         self.root.configure(bg="#2F2F2F")
 
         # 當前坐標 (X, Y, Z, C)
@@ -21,6 +1573,17 @@ class CNCControlInterface:
         self.execution_mode = "連續"  # 執行模式：連續 或 單節（自動模式下使用）
         self.current_line = 0  # 當前執行行數
         self.total_lines = 0  # 總行數
+        self.exec_job = None  # 已排程的執行器工作 (after 識別碼)
+        self.vm = None  # 執行中程式的虛擬機
+        self.current_action = None  # 進行中的動作 (動作, 參數)
+        self.interrupted_action = None  # 被暫停中斷、繼續時需重新執行的動作
+        self.motion = None  # 進行中的移動：起點、終點、開始時間、移動時間、完成回呼
+        self.motion_job = None  # 已排程的下一個移動畫面 (after 識別碼)
+        self.line_profiler = LineProfiler()  # 逐行執行剖析結果（跨多次執行累計）
+        self.profiling = False  # 是否在下次啟動時啟用剖析
+        self.profiler = None  # 執行中啟用剖析時為 line_profiler，關閉時為 None
+        self.profile_edit_count = -1  # 剖析開始時編輯器的編輯次數；之後再編輯則熱度欄已過期
+        self.ui = UIStateModel(self.root)  # 介面狀態模型（按鈕狀態、OUTPUT 顏色、坐標顯示）
 
         # 移動距離選項（下拉式選單）
         self.move_distances = ["0.01", "0.1", "0.5", "1.0", "5.0", "10.0"]
@@ -31,6 +1594,8 @@ class CNCControlInterface:
         self.input_components = {}   # INPUT: 根據 io 表格動態生成
         self.output_buttons = {}  # 儲存 OUTPUT 按鈕的引用
         self.input_labels = {}    # 儲存 INPUT 標籤的引用
+        self.io_bit_numbers = {}  # I/O 元件名稱 -> 位元編號（見 io_bit_number）
+        self.io_bit_table = []    # (元件狀態表, 名稱, 位元值)
         self.axis_buttons = []    # 儲存軸控制按鈕的引用
         self.auto_buttons = []    # 儲存自動模式按鈕的引用（啟動、暫停、停止）
 
@@ -38,9 +1603,25 @@ class CNCControlInterface:
         self.db_name = "machine_data.db"
         self.init_database()
 
+        # 點位空間索引（最近點、鄰近點與重複點查詢）
+        self.point_index = PointIndex()
+        self.load_point_index()
+
         # 資料表編輯狀態
-        self.edited_rows = set()  # 儲存被編輯但未儲存的行（IID）
+        self.edited_rows = set()  # 儲存被編輯但未儲存的行（IID，即點位原名稱）
         self.original_data = {}   # 儲存原始資料，用於恢復
+        self.pending_edits = {}   # 編輯後但未儲存的資料，捲動離開可見範圍後仍保留
+
+        # 虛擬化資料表狀態：只從資料庫讀取可見範圍內的資料列
+        self.table_sort = ("name", False)  # 排序欄位, 是否遞減
+        self.table_search = ""    # 名稱前綴搜尋
+        self.table_filter = None  # 只顯示指定的點位名稱（鄰近點查詢結果）
+        self.table_anchor = None  # 第一個可見資料列的排序鍵 (排序欄位值, 名稱)，None 表示從頭開始
+        self.table_offset = 0     # 第一個可見資料列的位置（用於滾動條）
+        self.table_total = 0      # 符合條件的資料筆數
+        self.table_page_size = 5  # 可見的資料列數
+        self.search_job = None
+        self.cell_editor = None   # 資料表中編輯中的輸入框
 
         # 定義樣式
         self.configure_styles()
@@ -51,6 +1632,14 @@ class CNCControlInterface:
         # 創建主框架
         self.create_widgets()
 
+        # 啟動時序紀錄
+        self.recorder = None
+        self.start_recorder()
+
+        # 建立機台狀態共享記憶體
+        self.state_block = None
+        self.start_state_block()
+
     def init_database(self):
         # 初始化資料庫，如果表格不存在則建立
         try:
@@ -66,6 +1655,9 @@ class CNCControlInterface:
                         c REAL
                     )
                 ''')
+                # 建立坐標欄位索引，供資料表依坐標排序和分頁時使用
+                for column in ("x", "y", "z", "c"):
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_point_{column} ON point ({column}, name)")
                 # 檢查 io 表格是否存在並確認其結構
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS io (
@@ -94,6 +1686,18 @@ class CNCControlInterface:
             print(f"資料庫初始化失敗: {e}")
             messagebox.showerror("錯誤", f"無法初始化資料庫: {e}")
 
+    def load_point_index(self):
+        # 從 point 表格建立點位空間索引
+        try:
+            with sqlite3.connect(self.db_name) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name, x, y, z, c FROM point")
+                self.point_index.build(cursor.fetchall())
+                print(f"點位索引已建立: {len(self.point_index)} 筆")
+        except sqlite3.Error as e:
+            print(f"無法建立點位索引: {e}")
+            messagebox.showerror("錯誤", f"無法建立點位索引: {e}")
+
     def configure_styles(self):
         # 使用 ttk.Style 定義按鈕樣式
         style = ttk.Style()
@@ -179,19 +1783,29 @@ class CNCControlInterface:
         try:
             with sqlite3.connect(self.db_name) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT name, io FROM io")
+                cursor.execute("SELECT name, io, number FROM io")
                 rows = cursor.fetchall()
 
                 # 清空現有的 input 和 output 狀態
                 self.input_components.clear()
                 self.output_components.clear()
+                self.io_bit_numbers.clear()
 
                 # 根據 io 欄位分類
-                for name, io_type in rows:
+                for name, io_type, number in rows:
                     if io_type.lower() == "input":
                         self.input_components[name] = random.choice([True, False])
                     elif io_type.lower() == "output":
                         self.output_components[name] = False  # 預設關閉
+                    else:
+                        continue
+                    if number is not None and number >= 0:
+                        self.io_bit_numbers[name] = io_bit_number(io_type.lower() == "input", number)
+
+                # 預先整理 (元件狀態表, 名稱, 位元值)，組成位元向量時不需重新查詢
+                self.io_bit_table = [(components, name, 1 << self.io_bit_numbers[name])
+                                     for components in (self.output_components, self.input_components)
+                                     for name in components if name in self.io_bit_numbers]
 
                 print("OUTPUT 元件初始狀態:", self.output_components)
                 print("INPUT 元件初始狀態:", self.input_components)
@@ -235,8 +1849,17 @@ class CNCControlInterface:
         # 左側：程式碼顯示框架（高度為 10 行）
         code_frame = ttk.LabelFrame(left_frame, text="程式碼")
         code_frame.pack(pady=5, fill="both", expand=True)
-        self.code_text = tk.Text(code_frame, height=10, width=50, font=("Helvetica", 10), bg="#263238", fg="white", insertbackground="white")
-        self.code_text.pack(pady=5, padx=5, fill="both", expand=True)
+        editor_frame = tk.Frame(code_frame, bg="#2F2F2F")
+        editor_frame.pack(fill="both", expand=True)
+        # 執行剖析熱度欄（每行的實際時間）
+        self.profile_gutter = tk.Canvas(editor_frame, width=PROFILE_GUTTER_WIDTH, bg="#263238", highlightthickness=0, bd=0)
+        self.profile_gutter.pack(side=tk.LEFT, fill="y", pady=5, padx=(5, 0))
+        self.code_text = tk.Text(editor_frame, height=10, width=50, font=("Helvetica", 10), bg="#263238", fg="white", insertbackground="white")
+        self.code_text.pack(side=tk.LEFT, pady=5, padx=5, fill="both", expand=True)
+        self.highlighter = ProgramHighlighter(self.code_text, self.program_name_sets)
+        self.code_text.configure(yscrollcommand=self.on_code_scroll)
+        self.highlighter.on_edit = self.on_code_edit
+        self.code_text.bind("<Configure>", lambda event: self.draw_profile_gutter(), add="+")
 
         # 程式碼操作按鈕
         code_button_frame = tk.Frame(code_frame, bg="#2F2F2F")
@@ -244,6 +1867,10 @@ class CNCControlInterface:
         ttk.Button(code_button_frame, text="讀取檔案", style="File.TButton", command=self.load_file).pack(side=tk.LEFT, padx=5)
         ttk.Button(code_button_frame, text="儲存檔案", style="File.TButton", command=self.save_file).pack(side=tk.LEFT, padx=5)
         ttk.Button(code_button_frame, text="另存新檔", style="File.TButton", command=self.save_file_as).pack(side=tk.LEFT, padx=5)
+        ttk.Button(code_button_frame, text="模擬執行", style="File.TButton", command=self.simulate_program).pack(side=tk.LEFT, padx=5)
+        self.profile_button = ttk.Button(code_button_frame, text="執行剖析: 關", style="File.TButton", command=self.toggle_profiling)
+        self.profile_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(code_button_frame, text="剖析報告", style="File.TButton", command=self.export_profile_report).pack(side=tk.LEFT, padx=5)
 
         # 左側：自動控制（1x3 格子）
         auto_frame = ttk.LabelFrame(left_frame, text="自動控制")
@@ -278,6 +1905,7 @@ class CNCControlInterface:
         self.status_label.pack(pady=5)
         self.progress_label = tk.Label(status_frame, text="進度: 0/0", font=("Helvetica", 10), bg="#2F2F2F", fg="#00FF00")
         self.progress_label.pack(pady=5)
+        ttk.Button(status_frame, text="匯出紀錄", style="File.TButton", command=self.export_record).pack(pady=5)
 
         # 右側：控制按鈕區域
         # 手動控制：方向鍵 (2x4 格子) + 移動距離下拉選單
@@ -307,6 +1935,8 @@ class CNCControlInterface:
             button = ttk.Button(manual_grid, text=text, width=8, style="Axis.TButton", command=lambda a=axis, d=direction: self.move_axis(a, d))
             button.grid(row=idx//2, column=idx%2, padx=5, pady=5)
             self.axis_buttons.append(button)
+        for axis in AXES:
+            self.ui.watch((f"coord:{axis}",), lambda a=axis: self.render_coord(a))
 
         # OUTPUT 控制：動態生成按鈕，根據 io 表格
         output_frame = ttk.LabelFrame(right_frame, text="OUTPUT 控制")
@@ -322,6 +1952,7 @@ class CNCControlInterface:
             button = ttk.Button(output_grid, text=comp_name, width=10, style=button_style, command=lambda c=comp_name: self.toggle_output(c))
             button.grid(row=idx//3, column=idx%3, padx=5, pady=5)
             self.output_buttons[comp_name] = button
+            self.ui.watch((f"output:{comp_name}",), lambda c=comp_name: self.render_output(c))
 
         # INPUT 狀態：動態生成標籤，根據 io 表格
         input_frame = ttk.LabelFrame(right_frame, text="INPUT 狀態")
@@ -342,29 +1973,42 @@ class CNCControlInterface:
         data_frame = ttk.LabelFrame(right_frame, text="資料表")
         data_frame.pack(pady=5, fill="both", expand=True)
 
+        # 搜尋框（名稱前綴搜尋）
+        search_frame = tk.Frame(data_frame, bg="#2F2F2F")
+        search_frame.pack(fill="x", pady=2)
+        tk.Label(search_frame, text="搜尋名稱:", font=("Helvetica", 10), bg="#2F2F2F", fg="white").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=16)
+        search_entry.pack(side=tk.LEFT, padx=5)
+        search_entry.bind("<KeyRelease>", self.on_search_changed)
+        ttk.Button(search_frame, text="全部", style="File.TButton", command=self.clear_table_filter).pack(side=tk.LEFT, padx=5)
+        self.table_info_label = tk.Label(search_frame, text="共 0 筆", font=("Helvetica", 10), bg="#2F2F2F", fg="white")
+        self.table_info_label.pack(side=tk.LEFT, padx=5)
+
         # 創建一個框架來放置 Treeview 和滾動條
         table_frame = tk.Frame(data_frame, bg="#2F2F2F")
         table_frame.pack(fill="both", expand=True)
 
-        # 使用 Treeview 顯示資料表
+        # 使用 Treeview 顯示資料表（只放入可見範圍的資料列，IID 為點位名稱）
         columns = ("name", "x", "y", "z", "c")
         self.data_table = ttk.Treeview(table_frame, columns=columns, show="headings", height=5)
-        self.data_table.heading("name", text="名稱")
-        self.data_table.heading("x", text="X (mm)")
-        self.data_table.heading("y", text="Y (mm)")
-        self.data_table.heading("z", text="Z (mm)")
-        self.data_table.heading("c", text="C (°)")
+        self.table_headings = {"name": "名稱", "x": "X (mm)", "y": "Y (mm)", "z": "Z (mm)", "c": "C (°)"}
+        for column, text in self.table_headings.items():
+            self.data_table.heading(column, text=text, command=lambda c=column: self.sort_table(c))
         self.data_table.column("name", width=100, anchor="center")
         self.data_table.column("x", width=80, anchor="center")
         self.data_table.column("y", width=80, anchor="center")
         self.data_table.column("z", width=80, anchor="center")
         self.data_table.column("c", width=80, anchor="center")
 
-        # 創建滾動條
-        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.data_table.yview)
-        scrollbar.pack(side=tk.RIGHT, fill="y")
-        self.data_table.configure(yscrollcommand=scrollbar.set)
+        # 創建滾動條（依資料庫中的位置捲動，而非 Treeview 內的資料列）
+        self.table_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.on_table_scroll)
+        self.table_scrollbar.pack(side=tk.RIGHT, fill="y")
         self.data_table.pack(fill="both", expand=True)
+        self.data_table.bind("<MouseWheel>", self.on_table_wheel)
+        self.data_table.bind("<Button-4>", self.on_table_wheel)
+        self.data_table.bind("<Button-5>", self.on_table_wheel)
+        self.data_table.bind("<Configure>", self.on_table_configure)
 
         # 綁定雙擊事件以編輯資料表
         self.data_table.bind("<Double-1>", self.on_double_click)
@@ -377,16 +2021,31 @@ class CNCControlInterface:
         self.save_button = ttk.Button(data_button_frame, text="儲存編輯", style="SaveNormal.TButton", command=self.save_edited_data)
         self.save_button.pack(side=tk.LEFT, padx=5)
         ttk.Button(data_button_frame, text="刪除", style="File.TButton", command=self.delete_data).pack(side=tk.LEFT, padx=5)
+        ttk.Button(data_button_frame, text="最近點", style="File.TButton", command=self.snap_to_nearest_point).pack(side=tk.LEFT, padx=5)
+        ttk.Button(data_button_frame, text="鄰近點", style="File.TButton", command=self.find_nearby_points).pack(side=tk.LEFT, padx=5)
         move_button = ttk.Button(data_button_frame, text="移動到位置", style="File.TButton")
         move_button.pack(side=tk.LEFT, padx=5)
         # 綁定按鈕點擊事件以檢查 Ctrl 鍵
         move_button.bind("<Button-1>", self.move_to_selected_position)
 
+        # 控制按鈕狀態依操作模式和是否有未儲存的編輯決定
+        self.ui.watch(("operation_mode", "locked"), self.render_control_states)
+        self.ui.watch(("operation_mode",), self.render_mode_buttons)
+        self.ui.watch(("execution_mode",), self.render_mode_buttons)
+        self.ui.watch(("locked",), self.render_save_button)
+
         # 初次載入資料
         self.refresh_data_table()
 
+        # Esc 鍵立即中斷移動
+        self.root.bind("<Escape>", lambda event: self.on_escape())
+
         # 初始模式：手動模式
         self.update_button_states()
+        self.ui.set("execution_mode", self.execution_mode)
+        for name, state in self.output_components.items():
+            self.ui.set(f"output:{name}", state)
+        self.ui.flush()
 
     def on_double_click(self, event):
         # 雙擊編輯資料表單元格
@@ -406,10 +2065,22 @@ class CNCControlInterface:
         entry = ttk.Entry(self.data_table)
         entry.insert(0, current_value)
         entry.place(x=event.x, y=event.y, anchor="nw")
+        self.cell_editor = entry
 
         def save_edit(event):
+            # 資料表捲動時輸入框已被關閉（該行可能已不在可見範圍內）
+            if self.cell_editor is not entry:
+                return
+            self.cell_editor = None
             new_value = entry.get()
-            values = list(self.data_table.item(item, "values"))
+            # 從未儲存的編輯或點位索引取得原本的值，不依賴資料表中的資料列
+            if item in self.pending_edits:
+                values = list(self.pending_edits[item])
+            elif item in self.point_index:
+                values = [item] + list(self.point_index.points[item])
+            else:
+                entry.destroy()
+                return
             # 驗證數值欄位
             if col_index > 0:  # x, y, z, c 必須是數字
                 try:
@@ -418,12 +2089,18 @@ class CNCControlInterface:
                     messagebox.showwarning("警告", "請輸入有效的數字！")
                     entry.destroy()
                     return
-            values[col_index] = new_value
-            self.data_table.item(item, values=values)
-            self.edited_rows.add(item)
+            if col_index == 0 and not new_value.strip():
+                messagebox.showwarning("警告", "名稱不可為空！")
+                entry.destroy()
+                return
             # 儲存原始資料
             if item not in self.original_data:
-                self.original_data[item] = list(self.data_table.item(item, "values"))
+                self.original_data[item] = list(values)
+            values[col_index] = new_value
+            if self.data_table.exists(item):
+                self.data_table.item(item, values=values)
+            self.pending_edits[item] = values
+            self.edited_rows.add(item)
             entry.destroy()
             self.update_control_states()
 
@@ -433,6 +2110,12 @@ class CNCControlInterface:
 
     def add_new_data(self):
         # 新增一筆資料，以當前坐標為預設值
+        coords = [self.coords[axis] for axis in ["X", "Y", "Z", "C"]]
+        duplicates = self.point_index.duplicates(coords)
+        if duplicates:
+            names = ", ".join(duplicates[:5])
+            if not messagebox.askyesno("確認", f"當前坐標與既有點位重複: {names}\n確定仍要新增嗎？"):
+                return
         try:
             with sqlite3.connect(self.db_name) as conn:
                 cursor = conn.cursor()
@@ -446,6 +2129,8 @@ class CNCControlInterface:
                     INSERT INTO point (name, x, y, z, c) VALUES (?, ?, ?, ?, ?)
                 ''', (name, self.coords["X"], self.coords["Y"], self.coords["Z"], self.coords["C"]))
                 conn.commit()
+                self.point_index.add(name, coords)
+                self.highlighter.invalidate()
                 print(f"已新增資料: {name}, X={self.coords['X']}, Y={self.coords['Y']}, Z={self.coords['Z']}, C={self.coords['C']}")
                 messagebox.showinfo("提示", f"已新增資料: {name}")
                 # 刷新資料表
@@ -459,23 +2144,33 @@ class CNCControlInterface:
         try:
             with sqlite3.connect(self.db_name) as conn:
                 cursor = conn.cursor()
-                valid_items = []
+                updated = []
                 for item in list(self.edited_rows):
-                    # 檢查 item 是否仍存在於 Treeview 中
-                    if item in self.data_table.get_children():
-                        values = self.data_table.item(item, "values")
-                        name = values[0]
-                        x, y, z, c = map(float, values[1:5])
-                        cursor.execute('''
-                            UPDATE point SET x = ?, y = ?, z = ?, c = ? WHERE name = ?
-                        ''', (x, y, z, c, name))
-                        valid_items.append(item)
+                    # 編輯內容保存在 pending_edits，不需要在可見範圍內
+                    values = self.pending_edits.get(item)
+                    if values is None:
+                        continue
+                    name = str(values[0])
+                    x, y, z, c = map(float, values[1:5])
+                    cursor.execute('''
+                        UPDATE point SET name = ?, x = ?, y = ?, z = ?, c = ? WHERE name = ?
+                    ''', (name, x, y, z, c, item))
+                    if cursor.rowcount:
+                        updated.append((item, name, (x, y, z, c)))
                 conn.commit()
+                # 寫入成功後才更新點位索引
+                for item, name, coords in updated:
+                    if name != item:
+                        self.point_index.remove(item)
+                    self.point_index.add(name, coords)
+                if any(name != item for item, name, _ in updated):
+                    self.highlighter.invalidate()
                 print("編輯資料已儲存到資料庫")
                 messagebox.showinfo("提示", "編輯資料已儲存")
                 # 清除編輯狀態
                 self.edited_rows.clear()
                 self.original_data.clear()
+                self.pending_edits.clear()
                 self.refresh_data_table()
         except sqlite3.Error as e:
             print(f"無法儲存編輯資料: {e}")
@@ -488,9 +2183,9 @@ class CNCControlInterface:
             messagebox.showwarning("警告", "請選擇要刪除的資料！")
             return
 
+        # IID 為資料庫中的點位名稱（名稱欄可能是尚未儲存的編輯）
         item = selected_item[0]
-        values = self.data_table.item(item, "values")
-        name = values[0]
+        name = item
 
         if messagebox.askyesno("確認", f"確定要刪除資料 '{name}' 嗎？"):
             try:
@@ -498,6 +2193,11 @@ class CNCControlInterface:
                     cursor = conn.cursor()
                     cursor.execute("DELETE FROM point WHERE name = ?", (name,))
                     conn.commit()
+                    self.point_index.remove(name)
+                    self.highlighter.invalidate()
+                    self.edited_rows.discard(item)
+                    self.original_data.pop(item, None)
+                    self.pending_edits.pop(item, None)
                     print(f"已刪除資料: {name}")
                     messagebox.showinfo("提示", f"已刪除資料: {name}")
                     # 刷新資料表
@@ -507,37 +2207,229 @@ class CNCControlInterface:
                 messagebox.showerror("錯誤", f"無法刪除資料: {e}")
 
     def refresh_data_table(self):
-        # 從資料庫讀取資料並更新資料表
+        # 重新計算符合條件的資料筆數，並從資料庫讀取目前位置的可見資料列
         try:
             with sqlite3.connect(self.db_name) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT name, x, y, z, c FROM point")
-                rows = cursor.fetchall()
+                conditions, params = self.table_conditions()
+                where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+                self.table_total = conn.execute(f"SELECT COUNT(*) FROM point{where}", params).fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"無法讀取資料庫: {e}")
+            messagebox.showerror("錯誤", f"無法讀取資料庫: {e}")
+            return
+
+        # 更新 edited_rows，移除不存在的點位
+        self.edited_rows = {item for item in self.edited_rows if item in self.point_index}
+        self.pending_edits = {item: values for item, values in self.pending_edits.items() if item in self.edited_rows}
+
+        max_offset = max(0, self.table_total - self.table_page_size)
+        if self.table_offset > max_offset:
+            self.scroll_table_to_offset(max_offset)
+        else:
+            self.render_table()
+        print("資料表已更新")
+        self.update_control_states()
+
+    def table_conditions(self):
+        # 搜尋與篩選條件
+        conditions, params = [], []
+        if self.table_filter is not None:
+            conditions.append("name IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(self.table_filter, ensure_ascii=False))
+        if self.table_search:
+            conditions.append("name >= ? AND name < ?")
+            params.extend([self.table_search, self.table_search + "\U0010ffff"])
+        return conditions, params
+
+    def table_query(self, columns, key=None, forward=True, inclusive=True):
+        # 組合資料表查詢（keyset 分頁）：從排序鍵 key 往排序方向 (forward) 或反方向讀取，回傳 (SQL, 參數)
+        column, descending = self.table_sort
+        ascending = forward != descending
+        conditions, params = self.table_conditions()
+        if key is not None:
+            op = (">=" if inclusive else ">") if ascending else ("<=" if inclusive else "<")
+            if column == "name":
+                conditions.append(f"name {op} ?")
+                params.append(key[1])
+            else:
+                conditions.append(f"({column}, name) {op} (?, ?)")
+                params.extend(key)
+        direction = "ASC" if ascending else "DESC"
+        order = f"name {direction}" if column == "name" else f"{column} {direction}, name {direction}"
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"SELECT {columns} FROM point{where} ORDER BY {order}", params
+
+    def fetch_table_key(self, key, forward, inclusive, skip):
+        # 從排序鍵 key 開始略過 skip 筆，回傳該資料列的排序鍵；超出範圍時回傳 None
+        sql, params = self.table_query(f"{self.table_sort[0]}, name", key, forward, inclusive)
+        with sqlite3.connect(self.db_name) as conn:
+            row = conn.execute(f"{sql} LIMIT 1 OFFSET ?", params + [skip]).fetchone()
+        return tuple(row) if row is not None else None
+
+    def render_table(self):
+        # 只讀取並顯示從 table_anchor 開始的一頁資料
+        try:
+            sql, params = self.table_query("name, x, y, z, c", self.table_anchor)
+            with sqlite3.connect(self.db_name) as conn:
+                rows = conn.execute(f"{sql} LIMIT ?", params + [self.table_page_size]).fetchall()
+        except sqlite3.Error as e:
+            print(f"無法讀取資料庫: {e}")
+            messagebox.showerror("錯誤", f"無法讀取資料庫: {e}")
+            return
+
+        # 關閉編輯中的輸入框（放置的位置對應的資料列即將改變）
+        if self.cell_editor is not None:
+            entry, self.cell_editor = self.cell_editor, None
+            entry.destroy()
+
+        selection = self.data_table.selection()
+        children = self.data_table.get_children()
+        if children:
+            self.data_table.delete(*children)
+        for row in rows:
+            name = row[0]
+            # 未儲存的編輯內容優先顯示
+            self.data_table.insert("", tk.END, iid=name, values=self.pending_edits.get(name, list(row)))
+        selection = [item for item in selection if self.data_table.exists(item)]
+        if selection:
+            self.data_table.selection_set(selection)
+
+        # 更新滾動條與筆數
+        if self.table_total:
+            first = self.table_offset / self.table_total
+            last = min(1.0, (self.table_offset + len(rows)) / self.table_total)
+        else:
+            first, last = 0.0, 1.0
+        self.table_scrollbar.set(first, last)
+        self.table_info_label.config(text=f"共 {self.table_total} 筆")
+
+    def scroll_table(self, rows):
+        # 相對捲動 rows 列：以目前第一列的排序鍵往前或往後查詢，不需從頭計算位置
+        if rows > 0:
+            rows = min(rows, self.table_total - self.table_page_size - self.table_offset)
+            if rows <= 0:
+                return
+            key = self.fetch_table_key(self.table_anchor, True, True, rows)
+        else:
+            rows = -min(-rows, self.table_offset)
+            if rows == 0:
+                return
+            key = self.fetch_table_key(self.table_anchor, False, False, -rows - 1)
+        if key is None:
+            # 資料已被其他操作變更，重新讀取
+            self.refresh_data_table()
+            return
+        self.table_anchor = None if self.table_offset + rows == 0 else key
+        self.table_offset += rows
+        self.render_table()
+
+    def scroll_table_to_offset(self, offset):
+        # 捲動到指定位置（拖曳滾動條時使用）
+        offset = max(0, min(int(offset), self.table_total - self.table_page_size))
+        key = self.fetch_table_key(None, True, True, offset) if offset > 0 else None
+        self.table_anchor = key
+        self.table_offset = offset if key is not None else 0
+        self.render_table()
+
+    def on_table_scroll(self, *args):
+        # 滾動條事件：moveto 為拖曳，scroll 為點擊箭頭或空白處
+        if args[0] == "moveto":
+            self.scroll_table_to_offset(float(args[1]) * self.table_total)
+        elif args[0] == "scroll":
+            rows = int(args[1])
+            if args[2] == "pages":
+                rows *= self.table_page_size
+            self.scroll_table(rows)
+
+    def on_table_wheel(self, event):
+        # 滑鼠滾輪捲動（Linux 使用 Button-4/5）
+        self.scroll_table(-3 if event.num == 4 or event.delta > 0 else 3)
+        return "break"
+
+    def on_table_configure(self, event):
+        # 依 Treeview 高度計算可見的資料列數
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        page_size = max(1, event.height // row_height - 1)
+        if page_size != self.table_page_size:
+            self.table_page_size = page_size
+            self.render_table()
+
+    def sort_table(self, column):
+        # 點擊欄位標題排序，再次點擊切換遞增/遞減
+        current, descending = self.table_sort
+        self.table_sort = (column, not descending if column == current else False)
+        for name, text in self.table_headings.items():
+            if name == column:
+                text += " ▼" if self.table_sort[1] else " ▲"
+            self.data_table.heading(name, text=text)
+        self.table_anchor = None
+        self.table_offset = 0
+        self.render_table()
+
+    def on_search_changed(self, event):
+        # 輸入停頓後才查詢，避免每個按鍵都查詢資料庫
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(150, self.apply_search)
+
+    def apply_search(self):
+        self.search_job = None
+        self.table_search = self.search_var.get().strip()
+        self.table_filter = None
+        self.table_anchor = None
+        self.table_offset = 0
+        self.refresh_data_table()
+
+    def clear_table_filter(self):
+        # 清除搜尋和鄰近點篩選，顯示全部資料
+        self.search_var.set("")
+        self.apply_search()
 
-                # 清空現有資料
-                for item in self.data_table.get_children():
-                    self.data_table.delete(item)
-
-                # 更新資料表
-                valid_edited_rows = set()
-                for row in rows:
-                    name = row[0]
-                    values = list(row)
-                    item = self.data_table.insert("", tk.END, values=values)
-                    if item in self.edited_rows:
-                        valid_edited_rows.add(item)
-
-                # 更新 edited_rows，移除不存在的 item
-                self.edited_rows = valid_edited_rows
-                print("資料表已更新")
-                self.update_control_states()
+    def show_point(self, name):
+        # 捲動資料表使指定點位成為第一個可見資料列，並選取該點位
+        if name not in self.point_index:
+            return
+        if (self.table_filter is not None and name not in self.table_filter) or not name.startswith(self.table_search):
+            self.search_var.set("")
+            self.table_search = ""
+            self.table_filter = None
+        column = self.table_sort[0]
+        try:
+            with sqlite3.connect(self.db_name) as conn:
+                row = conn.execute(f"SELECT {column} FROM point WHERE name = ?", (name,)).fetchone()
+                if row is None:
+                    return
+                key = (row[0], name)
+                sql, params = self.table_query("COUNT(*)", key, forward=False, inclusive=False)
+                offset = conn.execute(sql, params).fetchone()[0]
         except sqlite3.Error as e:
             print(f"無法讀取資料庫: {e}")
             messagebox.showerror("錯誤", f"無法讀取資料庫: {e}")
+            return
+        self.table_anchor = key if offset > 0 else None
+        self.table_offset = offset
+        self.refresh_data_table()
+        if self.data_table.exists(name):
+            self.data_table.selection_set(name)
+            self.data_table.see(name)
+
+    def query_point_names(self, prefix, limit=50):
+        # 以名稱前綴查詢點位名稱（使用主鍵索引）
+        try:
+            with sqlite3.connect(self.db_name) as conn:
+                rows = conn.execute("SELECT name FROM point WHERE name >= ? AND name < ? ORDER BY name LIMIT ?",
+                                    (prefix, prefix + "\U0010ffff", limit)).fetchall()
+            return [row[0] for row in rows]
+        except sqlite3.Error as e:
+            print(f"無法讀取資料庫: {e}")
+            return []
 
     def move_to_position(self, item):
-        # 獲取資料表中的位置
-        values = self.data_table.item(item, "values")
+        # 獲取資料表中的位置（不在可見範圍內時從點位索引取得）
+        if self.data_table.exists(item):
+            values = self.data_table.item(item, "values")
+        else:
+            values = [item] + list(self.point_index.points.get(item, ()))
         name = values[0]
         try:
             target_coords = {
@@ -551,37 +2443,85 @@ class CNCControlInterface:
             print(f"移動失敗，資料格式錯誤: {e}")
             return False
 
-        # 計算移動距離（用於模擬移動時間）
-        total_distance = 0.0
-        for axis in ["X", "Y", "Z", "C"]:
-            distance = abs(target_coords[axis] - self.coords[axis])
-            total_distance += distance
-
-        # 模擬移動時間（每 1 mm 或 1° 花費 0.1 秒）
-        move_time = total_distance * 0.1
-        if move_time < 0.5:  # 最小移動時間為 0.5 秒
-            move_time = 0.5
+        if self.motion is not None:
+            messagebox.showwarning("警告", "機械手臂移動中，請等待移動完成或按 Esc 中斷！")
+            return False
+        if self.is_running:
+            messagebox.showwarning("警告", "程式正在運行或暫停中，請先停止程式！")
+            return False
 
         # 更新狀態顯示為「移動中」
         self.status_label.config(text=f"狀態: 移動中 ({name})")
-        self.root.update()  # 立即更新介面
         print(f"開始移動到位置 '{name}': X={target_coords['X']}, Y={target_coords['Y']}, Z={target_coords['Z']}, C={target_coords['C']}")
 
-        # 模擬移動
-        time.sleep(move_time)
+        def on_done(completed):
+            # 更新狀態顯示為「已停止」
+            self.status_label.config(text="狀態: 已停止")
+            if completed:
+                print(f"移動完成: X={self.coords['X']}, Y={self.coords['Y']}, Z={self.coords['Z']}, C={self.coords['C']}")
+                messagebox.showinfo("提示", f"已移動到位置: {name}")
+            else:
+                print(f"移動到位置 '{name}' 已中斷: X={self.coords['X']}, Y={self.coords['Y']}, Z={self.coords['Z']}, C={self.coords['C']}")
+
+        # 模擬移動（逐畫面更新坐標，可隨時中斷）
+        self.start_motion(target_coords, on_done)
+        return True
 
-        # 更新坐標
-        for axis, value in target_coords.items():
-            self.coords[axis] = value
-            unit = "°" if axis == "C" else "mm"
-            display_text = f"{self.coords[axis]:.3f} {unit}"
-            self.coord_labels[axis].config(text=display_text)
+    def start_motion(self, target_coords, on_done):
+        # 開始移動到目標坐標，移動時間依移動模型計算；完成或中斷時呼叫 on_done(是否完成)
+        # 同一時間只保留一個移動：先中斷進行中的移動（通知其 on_done），避免重複的移動畫面排程
+        self.abort_motion()
+        start = [self.coords[axis] for axis in AXES]
+        target = [target_coords[axis] for axis in AXES]
+        self.motion = {
+            "start": start,
+            "target": target,
+            "start_time": time.perf_counter(),
+            "move_time": move_time_between(start, target),
+            "on_done": on_done,
+        }
+        self.motion_job = self.root.after(MOTION_FRAME_MS, self.motion_step)
+
+    def motion_step(self):
+        # 依經過時間內插當前坐標，到達終點後結束移動
+        self.motion_job = None
+        motion = self.motion
+        if motion is None:
+            return
+        progress = min((time.perf_counter() - motion["start_time"]) / motion["move_time"], 1.0)
+        for axis, start, target in zip(AXES, motion["start"], motion["target"]):
+            self.coords[axis] = target if progress >= 1.0 else start + (target - start) * progress
+        self.update_coord_labels()
+        if progress < 1.0:
+            self.motion_job = self.root.after(MOTION_FRAME_MS, self.motion_step)
+            return
+        self.motion = None
+        motion["on_done"](True)
 
-        # 更新狀態顯示為「已停止」
-        self.status_label.config(text="狀態: 已停止")
-        print(f"移動完成: X={self.coords['X']}, Y={self.coords['Y']}, Z={self.coords['Z']}, C={self.coords['C']}")
-        messagebox.showinfo("提示", f"已移動到位置: {name}")
-        return True
+    def on_escape(self):
+        # Esc：程式執行中改為暫停（保留被中斷的動作，繼續時重新執行），否則中斷手動的移動
+        if self.is_running:
+            if not self.is_paused:
+                self.pause_machine()
+            return
+        self.abort_motion()
+
+    def abort_motion(self):
+        # 立即中斷進行中的移動，坐標停在當前位置
+        motion = self.motion
+        if motion is None:
+            return
+        if self.motion_job is not None:
+            self.root.after_cancel(self.motion_job)
+            self.motion_job = None
+        self.motion = None
+        motion["on_done"](False)
+
+    def update_coord_labels(self):
+        # 更新坐標顯示並發布狀態
+        for axis in AXES:
+            self.ui.set(f"coord:{axis}", self.coords[axis])
+        self.publish_state()
 
     def move_to_selected_position(self, event):
         # 檢查是否按住 Ctrl 鍵
@@ -598,17 +2538,8 @@ class CNCControlInterface:
                 print("移動失敗，可能是資料格式錯誤")
             return
 
-        # 如果沒有選中的行，顯示下拉選單選擇位置
-        try:
-            with sqlite3.connect(self.db_name) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT name FROM point")
-                position_names = [row[0] for row in cursor.fetchall()]
-        except sqlite3.Error as e:
-            print(f"無法讀取資料庫: {e}")
-            messagebox.showerror("錯誤", f"無法讀取資料庫: {e}")
-            return
-
+        # 如果沒有選中的行，顯示下拉選單選擇位置（輸入名稱前綴篩選，只讀取部分名稱）
+        position_names = self.query_point_names("")
         if not position_names:
             messagebox.showwarning("警告", "目前沒有可用的位置！")
             return
@@ -622,19 +2553,18 @@ class CNCControlInterface:
 
         tk.Label(dialog, text="選擇要移動到的位置：", font=("Helvetica", 10), bg="#2F2F2F", fg="white").pack(pady=5)
         position_var = tk.StringVar(value=position_names[0])
-        position_combobox = ttk.Combobox(dialog, textvariable=position_var, values=position_names, state="readonly")
+        position_combobox = ttk.Combobox(dialog, textvariable=position_var, values=position_names)
         position_combobox.pack(pady=5)
+        position_combobox.bind("<KeyRelease>", lambda event: position_combobox.configure(values=self.query_point_names(position_var.get())))
 
         def confirm_move():
             selected_name = position_var.get()
-            # 查找對應的 item
-            for item in self.data_table.get_children():
-                values = self.data_table.item(item, "values")
-                if values[0] == selected_name:
-                    success = self.move_to_position(item)
-                    if not success:
-                        print(f"移動到位置 '{selected_name}' 失敗")
-                    break
+            if selected_name not in self.point_index:
+                messagebox.showwarning("警告", f"找不到位置 '{selected_name}'！", parent=dialog)
+                return
+            success = self.move_to_position(selected_name)
+            if not success:
+                print(f"移動到位置 '{selected_name}' 失敗")
             dialog.destroy()
 
         ttk.Button(dialog, text="確認", command=confirm_move).pack(pady=5)
@@ -648,68 +2578,117 @@ class CNCControlInterface:
         y = (dialog.winfo_screenheight() // 2) - (height // 2)
         dialog.geometry(f"{width}x{height}+{x}+{y}")
 
-    def update_control_states(self):
-        # 根據編輯狀態啟用或禁用控制功能，並更新「儲存編輯」按鈕的樣式
-        if self.edited_rows:
-            # 有未儲存的編輯，禁用手動和自動控制，按鈕文字變為紅色
-            for button in self.axis_buttons:
-                button.config(state=tk.DISABLED)
-            for button in self.output_buttons.values():
-                button.config(state=tk.DISABLED)
-            for button in self.auto_buttons:
-                button.config(state=tk.DISABLED)
-            self.exec_mode_button.config(state=tk.DISABLED)
-            self.distance_combobox.config(state="disabled")
-            self.mode_button.config(state=tk.DISABLED)
-            self.save_button.config(style="SaveEdited.TButton")  # 文字變為紅色
+    def snap_to_nearest_point(self):
+        # 找出最接近當前坐標的點位，選取並詢問是否移動過去
+        coords = [self.coords[axis] for axis in ["X", "Y", "Z", "C"]]
+        name, distance = self.point_index.nearest(coords)
+        if name is None:
+            messagebox.showwarning("警告", "目前沒有可用的位置！")
+            return
+        self.show_point(name)
+        print(f"最近點位: {name}, 距離 {distance:.3f}")
+        if distance > DUPLICATE_TOLERANCE and messagebox.askyesno("確認", f"最近點位為 '{name}'（距離 {distance:.3f}），是否移動到該位置？"):
+            self.move_to_position(name)
+
+    def find_nearby_points(self):
+        # 查詢指定半徑內的點位：以選取的點位為中心，未選取時以當前坐標為中心
+        radius = simpledialog.askfloat("鄰近點", "查詢半徑:", initialvalue=5.0, minvalue=0.0, parent=self.root)
+        if radius is None:
+            return
+        center_name = None
+        selected_item = self.data_table.selection()
+        if selected_item:
+            center_name = selected_item[0]
+        if center_name in self.point_index:
+            coords = self.point_index.points[center_name]
         else:
-            # 無未儲存的編輯，根據操作模式更新按鈕狀態，按鈕文字恢復黑色
-            self.update_button_states()
-            self.save_button.config(style="SaveNormal.TButton")  # 文字恢復黑色
+            center_name = None
+            coords = [self.coords[axis] for axis in ["X", "Y", "Z", "C"]]
+
+        found = [(name, distance) for name, distance in self.point_index.within(coords, radius) if name != center_name]
+        if found:
+            # 資料表只顯示查詢結果，按「全部」恢復
+            self.search_var.set("")
+            self.table_search = ""
+            self.table_filter = [name for name, _ in found]
+            self.table_anchor = None
+            self.table_offset = 0
+            self.refresh_data_table()
+        center_text = f"'{center_name}'" if center_name else "當前坐標"
+        print(f"{center_text} 半徑 {radius} 內的點位: {[name for name, _ in found]}")
+        messagebox.showinfo("提示", f"{center_text} 半徑 {radius} 內共有 {len(found)} 個點位")
+
+    def program_name_sets(self):
+        # 提供語法上色檢查用的點位與 I/O 名稱
+        return {"point": self.point_index.points, "output": self.output_components, "input": self.input_components}
+
+    def update_control_states(self):
+        # 有未儲存的編輯時鎖定手動和自動控制（實際的元件更新由 render_control_states 批次套用）
+        self.ui.set("locked", bool(self.edited_rows))
+
+    def render_control_states(self):
+        # 根據操作模式和編輯狀態啟用或禁用控制功能，只更新狀態有變化的元件
+        locked = self.ui.get("locked", False)
+        manual = self.ui.get("operation_mode") == "手動"
+        manual_state = tk.NORMAL if manual and not locked else tk.DISABLED
+        auto_state = tk.NORMAL if not manual and not locked else tk.DISABLED
+        for button in self.axis_buttons:
+            self.ui.apply(button, state=manual_state)
+        for button in self.output_buttons.values():
+            self.ui.apply(button, state=manual_state)
+        for button in self.auto_buttons:
+            self.ui.apply(button, state=auto_state)
+        self.ui.apply(self.exec_mode_button, state=auto_state)
+        self.ui.apply(self.distance_combobox, state="normal" if manual_state == tk.NORMAL else "disabled")
+        self.ui.apply(self.mode_button, state=tk.DISABLED if locked else tk.NORMAL)
+
+    def render_save_button(self):
+        # 有未儲存的編輯時「儲存編輯」按鈕文字變為紅色
+        self.ui.apply(self.save_button, style="SaveEdited.TButton" if self.ui.get("locked") else "SaveNormal.TButton")
+
+    def render_mode_buttons(self):
+        self.ui.apply(self.mode_button, text=f"操作模式: {self.ui.get('operation_mode')}")
+        self.ui.apply(self.exec_mode_button, text=f"執行模式: {self.ui.get('execution_mode')}")
+
+    def render_output(self, component):
+        style = "OutputOn.TButton" if self.ui.get(f"output:{component}") else "OutputOff.TButton"
+        self.ui.apply(self.output_buttons[component], style=style)
+
+    def render_coord(self, axis):
+        unit = "°" if axis == "C" else "mm"
+        self.ui.apply(self.coord_labels[axis], text=f"{self.ui.get(f'coord:{axis}'):.3f} {unit}")
 
     def toggle_operation_mode(self):
         # 限制模式切換：必須在程式停止時才能切換
         if self.is_running:
             messagebox.showwarning("警告", "程式正在運行或暫停中，請先停止程式再切換模式！")
             return
+        if self.motion is not None:
+            messagebox.showwarning("警告", "機械手臂正在移動中，請等待移動完成或按 Esc 中斷後再切換模式！")
+            return
         # 切換操作模式：手動 或 自動
         self.operation_mode = "自動" if self.operation_mode == "手動" else "手動"
-        self.mode_button.config(text=f"操作模式: {self.operation_mode}")
         self.update_button_states()
+        self.publish_state()
         print(f"操作模式切換為: {self.operation_mode}")
 
     def toggle_execution_mode(self):
         # 切換執行模式：連續 或 單節（僅在自動模式下生效）
         self.execution_mode = "單節" if self.execution_mode == "連續" else "連續"
-        self.exec_mode_button.config(text=f"執行模式: {self.execution_mode}")
+        self.ui.set("execution_mode", self.execution_mode)
+        self.publish_state()
         print(f"執行模式切換為: {self.execution_mode}")
 
     def update_button_states(self):
-        # 根據操作模式啟用或禁用按鈕
-        if self.operation_mode == "手動":
-            # 手動模式：啟用軸控制和 OUTPUT 控制按鈕，禁用自動模式按鈕
-            for button in self.axis_buttons:
-                button.config(state=tk.NORMAL)
-            for button in self.output_buttons.values():
-                button.config(state=tk.NORMAL)
-            for button in self.auto_buttons:
-                button.config(state=tk.DISABLED)
-            self.exec_mode_button.config(state=tk.DISABLED)
-            self.distance_combobox.config(state="normal")
-        else:
-            # 自動模式：啟用自動模式按鈕，禁用軸控制和 OUTPUT 控制按鈕
-            for button in self.axis_buttons:
-                button.config(state=tk.DISABLED)
-            for button in self.output_buttons.values():
-                button.config(state=tk.DISABLED)
-            for button in self.auto_buttons:
-                button.config(state=tk.NORMAL)
-            self.exec_mode_button.config(state=tk.NORMAL)
-            self.distance_combobox.config(state="disabled")
-        self.mode_button.config(state=tk.NORMAL)
+        # 根據操作模式啟用或禁用按鈕（由 render_control_states 批次套用）
+        self.ui.set("operation_mode", self.operation_mode)
 
     def close_program(self):
         # 關閉程式
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.state_block is not None:
+            self.state_block.close()
         self.root.destroy()
 
     def load_file(self):
@@ -757,14 +2736,18 @@ class CNCControlInterface:
         # 切換 OUTPUT 元件狀態（僅改變顏色，不改變文字）
         if self.operation_mode != "手動":
             return
-        self.output_components[component] = not self.output_components[component]
-        style = "OutputOn.TButton" if self.output_components[component] else "OutputOff.TButton"
-        self.output_buttons[component].config(style=style)
-        print(f"{component} 現在狀態: {'ON' if self.output_components[component] else 'OFF'}")
+        self.set_output(component, not self.output_components[component])
+
+    def set_output(self, component, state):
+        # 設定 OUTPUT 元件狀態並更新按鈕顏色
+        self.output_components[component] = state
+        self.ui.set(f"output:{component}", state)
+        self.publish_state()
+        print(f"{component} 現在狀態: {'ON' if state else 'OFF'}")
 
     def move_axis(self, axis, direction):
-        # 僅在手動模式下允許移動軸
-        if self.operation_mode != "手動":
+        # 僅在手動模式下允許移動軸，移動到位置的過程中不接受寸動
+        if self.operation_mode != "手動" or self.motion is not None:
             return
         # 獲取移動距離
         try:
@@ -777,10 +2760,10 @@ class CNCControlInterface:
             return
         # 模擬移動，按選擇的距離移動
         self.coords[axis] += direction * distance
+        self.ui.set(f"coord:{axis}", self.coords[axis])
+        self.publish_state()
         unit = "°" if axis == "C" else "mm"
-        display_text = f"{self.coords[axis]:.3f} {unit}"
-        self.coord_labels[axis].config(text=display_text)
-        print(f"移動 {axis} 軸到 {display_text}")
+        print(f"移動 {axis} 軸到 {self.coords[axis]:.3f} {unit}")
 
     def start_machine(self):
         if self.operation_mode != "自動":
@@ -790,11 +2773,34 @@ class CNCControlInterface:
                 # 從暫停狀態繼續執行
                 self.is_paused = False
                 self.status_label.config(text="狀態: 運行中")
+                self.publish_state()
                 print("機械手臂繼續執行")
-                self.execute_next_line(self.current_line)
+                self.cancel_execution()
+                if self.interrupted_action is not None:
+                    # 重新執行被暫停中斷的動作（移動會從當前位置繼續移動到目標）
+                    action, arg = self.interrupted_action
+                    self.interrupted_action = None
+                    if self.profiler is not None:
+                        self.profiler.resume()
+                    self.perform_action(action, arg)
+                else:
+                    self.execute_next_line()
                 return
             messagebox.showwarning("警告", "機械手臂已在運行!")
             return
+        if self.motion is not None:
+            messagebox.showwarning("警告", "機械手臂正在移動中，請等待移動完成或按 Esc 中斷!")
+            return
+
+        # 編譯文字欄中的程式碼
+        code_lines = self.code_text.get(1.0, tk.END).rstrip("\n").splitlines()
+        if not any(line.strip() for line in code_lines):
+            messagebox.showwarning("警告", "程式碼欄位為空，無法執行!")
+            return
+        program = self.compile_program(code_lines)
+        if program is None:
+            return
+
         self.is_running = True
         self.is_paused = False
         self.current_line = 0  # 重置行數
@@ -802,17 +2808,27 @@ class CNCControlInterface:
         messagebox.showinfo("狀態", "機械手臂已啟動")
         print("機械手臂啟動")
 
-        # 一行一行執行文字欄中的程式碼
-        code_lines = self.code_text.get(1.0, tk.END).strip().splitlines()
-        if not code_lines or not code_lines[0]:
-            messagebox.showwarning("警告", "程式碼欄位為空，無法執行!")
-            self.stop_machine()
-            return
-
+        self.vm = ProgramVM(program, self.point_index.points, lambda name: self.input_components.get(name, False))
         self.code_lines = code_lines
         self.total_lines = len(self.code_lines)
+        self.current_action = None
+        self.interrupted_action = None
+        self.profiler = self.line_profiler if self.profiling else None
+        if self.profiler is not None:
+            self.profiler.begin_run(code_lines)
+            self.profile_edit_count = self.highlighter.edit_count
         self.update_progress()  # 更新進度顯示
-        self.execute_next_line(0)
+        self.execute_next_line()
+
+    def compile_program(self, code_lines):
+        # 編譯程式，發生錯誤時顯示錯誤並移到錯誤行，回傳 None
+        try:
+            return ProgramCompiler(self.point_index.points, self.output_components, self.input_components).compile(code_lines)
+        except ProgramError as e:
+            print(f"程式編譯錯誤: {e}")
+            self.code_text.see(f"{e.line_no}.0")
+            messagebox.showerror("錯誤", f"程式錯誤，無法執行!\n{e}")
+            return None
 
     def pause_machine(self):
         if self.operation_mode != "自動":
@@ -824,43 +2840,333 @@ class CNCControlInterface:
             messagebox.showwarning("警告", "機械手臂已在暫停狀態!")
             return
         self.is_paused = True
+        self.cancel_execution()
+        if self.profiler is not None:
+            self.profiler.suspend()
+        if self.current_action is not None:
+            # 中斷進行中的動作，繼續時重新執行
+            self.interrupted_action = self.current_action
+            self.abort_motion()
         self.status_label.config(text="狀態: 暫停中")
+        self.publish_state()
         print("機械手臂已暫停")
 
-    def execute_next_line(self, index):
-        if not self.is_running or self.is_paused or index >= len(self.code_lines):
+    def schedule_execution(self, delay, callback, *args):
+        # 排程執行器的下一個工作；同一時間只保留一個排程，避免重複的執行鏈
+        self.cancel_execution()
+        self.exec_job = self.root.after(delay, self.run_scheduled_job, callback, args)
+
+    def run_scheduled_job(self, callback, args):
+        self.exec_job = None
+        callback(*args)
+
+    def cancel_execution(self):
+        # 取消已排程的執行器工作
+        if self.exec_job is not None:
+            self.root.after_cancel(self.exec_job)
+            self.exec_job = None
+
+    def execute_next_line(self):
+        # 由虛擬機執行到下一個動作，再依動作類型執行
+        if not self.is_running or self.is_paused:
+            return
+        try:
+            action, arg, line_no = self.vm.step()
+        except ProgramError as e:
+            print(f"程式執行錯誤: {e}")
+            messagebox.showerror("錯誤", f"程式執行錯誤: {e}")
+            self.stop_machine()
+            return
+        if action is None:
+            # 程式執行完畢
+            self.stop_machine()
+            return
+        if action == "YIELD":
+            # 運算量大但沒有動作，先讓出事件迴圈再繼續
+            self.schedule_execution(0, self.execute_next_line)
             return
+        if self.profiler is not None:
+            self.profiler.begin_line(line_no)
+
         # 高亮當前行
         self.code_text.tag_remove("highlight", "1.0", tk.END)
-        self.code_text.tag_add("highlight", f"{index+1}.0", f"{index+1}.end")
+        self.code_text.tag_add("highlight", f"{line_no}.0", f"{line_no}.end")
         self.code_text.tag_config("highlight", background="#FFFF00", foreground="black")
 
-        line = self.code_lines[index].strip()
-        if line:
-            print(f"執行指令: {line}")
-        self.current_line = index + 1
+        print(f"執行指令: {self.code_lines[line_no - 1].strip()}")
+        self.current_line = line_no
         self.update_progress()  # 更新進度顯示
+        self.perform_action(action, arg)
+
+    def perform_action(self, action, arg):
+        # 執行一個動作，完成時呼叫 finish_action
+        self.current_action = (action, arg)
+        if action == "MOVE":
+            target = {axis: self.coords[axis] if value is None else value for axis, value in zip(AXES, arg)}
+            self.status_label.config(text="狀態: 運行中 (移動)")
+            if self.profiler is not None:
+                self.profiler.begin_phase("motion")
+            self.start_motion(target, self.finish_action)
+        elif action == "OUT":
+            self.set_output(*arg)
+            self.finish_action(True)
+        elif action == "WAIT":
+            self.schedule_execution(int(arg * 1000), self.finish_action, True)
+        else:
+            if self.profiler is not None:
+                self.profiler.begin_phase("wait")
+            self.wait_for_input(*arg)
+
+    def wait_for_input(self, name, state):
+        # 定時檢查 INPUT 狀態，符合時完成 WAITIN
+        if self.input_components.get(name, False) == state:
+            self.finish_action(True)
+        else:
+            self.schedule_execution(WAITIN_POLL_MS, self.wait_for_input, name, state)
 
+    def finish_action(self, completed):
+        # 動作完成後排程下一個動作；被中斷（暫停或停止）時不做任何事
+        if not completed or not self.is_running:
+            return
+        self.current_action = None
+        if self.profiler is not None:
+            self.profiler.end_line()
+            self.draw_profile_gutter()
         if self.execution_mode == "連續":
             # 連續執行模式：自動執行下一行
-            self.root.after(1000, self.execute_next_line, self.current_line)  # 每行延遲 1 秒
+            self.status_label.config(text="狀態: 運行中")
+            self.schedule_execution(LINE_INTERVAL_MS, self.execute_next_line)  # 每行延遲 1 秒
         else:
             # 單節執行模式：執行一行後暫停
             self.is_paused = True
             self.status_label.config(text="狀態: 暫停中 (單節執行)")
+            self.publish_state()
             print("單節執行完成，等待繼續")
 
-        if self.current_line >= len(self.code_lines):
-            self.stop_machine()
+    def simulate_program(self):
+        # 以虛擬機台模型全速模擬整個程式，估算週期時間
+        code_lines = self.code_text.get(1.0, tk.END).rstrip("\n").splitlines()
+        if not any(line.strip() for line in code_lines):
+            messagebox.showwarning("警告", "程式碼欄位為空，無法模擬!")
+            return
+        start_time = time.perf_counter()
+        program = self.compile_program(code_lines)
+        if program is None:
+            return
+        simulator = ProgramSimulator(self.point_index.points, [self.coords[axis] for axis in AXES], self.input_components)
+        result = simulator.run(program)
+        elapsed = time.perf_counter() - start_time
+        self.last_simulation = result
+
+        # 找出最耗時的程式行
+        line_times = result["line_times"]
+        slowest = heapq.nlargest(5, range(len(line_times)), key=line_times.__getitem__)
+        travel_text = ", ".join(f"{axis}={result['travel'][axis]:.3f}" for axis in AXES)
+        final_text = ", ".join(f"{axis}={result['final_coords'][axis]:.3f}" for axis in AXES)
+        slowest_text = "\n".join(f"  第 {index + 1} 行: {line_times[index]:.2f} 秒" for index in slowest)
+        summary = (f"總週期時間: {result['total_time']:.2f} 秒（{len(code_lines)} 行，{result['actions']} 個動作）\n"
+                   f"各軸移動距離: {travel_text}\n"
+                   f"最終坐標: {final_text}\n"
+                   f"最耗時的程式行:\n{slowest_text}")
+        if result["errors"]:
+            error_text = "\n".join(f"  第 {line_no} 行: {message}" for line_no, message in result["errors"][:5])
+            summary += f"\n錯誤 {len(result['errors'])} 個:\n{error_text}"
+        print(f"模擬完成，耗時 {elapsed:.3f} 秒\n{summary}")
+        if messagebox.askyesno("模擬結果", f"{summary}\n\n是否匯出每行時間報告？"):
+            self.export_simulation_report(code_lines, result)
+
+    def export_simulation_report(self, code_lines, result):
+        # 匯出每行時間報告 (CSV)
+        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+        if not file_path:
+            return
+        try:
+            with open(file_path, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(["行號", "程式", "時間(秒)"])
+                for index, line_time in enumerate(result["line_times"]):
+                    writer.writerow([index + 1, code_lines[index], f"{line_time:.3f}"])
+            print(f"模擬報告已匯出: {file_path}")
+            messagebox.showinfo("提示", f"模擬報告已匯出到: {file_path}")
+        except Exception as e:
+            messagebox.showerror("錯誤", f"無法匯出模擬報告: {e}")
+
+    def toggle_profiling(self):
+        # 切換逐行執行剖析；開啟後從下次啟動開始記錄，關閉時立即停止記錄
+        self.profiling = not self.profiling
+        if not self.profiling and self.profiler is not None:
+            self.profiler.finish_run()
+            self.profiler = None
+            self.draw_profile_gutter()
+        self.profile_button.config(text=f"執行剖析: {'開' if self.profiling else '關'}")
+        if self.profiling and self.is_running:
+            print("執行剖析已開啟，將從下次啟動開始記錄")
+        else:
+            print(f"執行剖析已{'開啟' if self.profiling else '關閉'}")
+
+    def on_code_scroll(self, first, last):
+        self.highlighter.on_scroll()
+        self.draw_profile_gutter()
+
+    def on_code_edit(self):
+        # 編輯後熱度欄可能已過期，有顯示內容時才重新繪製
+        if self.profile_gutter.find_all():
+            self.draw_profile_gutter()
+
+    def draw_profile_gutter(self):
+        # 在程式碼左側繪製可見行的熱度與時間佔比，最耗時的行以紅色標示
+        gutter = self.profile_gutter
+        gutter.delete("all")
+        profiler = self.line_profiler
+        if not profiler.runs or profiler.max_wall <= 0.0:
+            return
+        if self.highlighter.edit_count != self.profile_edit_count:
+            # 程式在剖析後被編輯，行號已不對應剖析結果，下次剖析執行時更新
+            gutter.create_text(PROFILE_GUTTER_WIDTH // 2, 8, text="已過期", fill="#90A4AE", font=("Helvetica", 8))
+            return
+        wall = profiler.wall
+        first = int(self.code_text.index("@0,0").split(".")[0])
+        last = min(int(self.code_text.index(f"@0,{self.code_text.winfo_height()}").split(".")[0]), len(wall))
+        for line_no in range(first, last + 1):
+            line_time = wall[line_no - 1]
+            if line_time <= 0.0:
+                continue
+            info = self.code_text.dlineinfo(f"{line_no}.0")
+            if info is None:
+                continue
+            y, height = info[1], info[3]
+            hot = profiler.threshold is not None and line_time >= profiler.threshold
+            color = "#FF5252" if hot else heat_color(min(1.0, line_time / profiler.max_wall))
+            gutter.create_rectangle(0, y, PROFILE_GUTTER_WIDTH, y + height, fill=color, outline="")
+            gutter.create_text(PROFILE_GUTTER_WIDTH - 2, y + height / 2, text=f"{line_time / profiler.total_wall * 100:.0f}%",
+                               anchor="e", fill="black" if hot or line_time * 2 > profiler.max_wall else "white", font=("Helvetica", 8))
+
+    def export_profile_report(self):
+        # 匯出逐行剖析報告 (CSV)，依實際時間由大到小排序
+        profiler = self.line_profiler
+        if not profiler.runs:
+            messagebox.showwarning("警告", "尚無剖析資料，請先開啟執行剖析並執行程式!")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+        if not file_path:
+            return
+        try:
+            with open(file_path, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(["排名", "行號", "程式", "執行次數", "實際時間(秒)", "平均時間(秒)", "移動時間(秒)",
+                                 "等待輸入時間(秒)", "其他時間(秒)", "佔比(%)", f"最耗時 {PROFILE_TOP_FRACTION:.0%}"])
+                for rank, row in enumerate(profiler.report_rows(), 1):
+                    writer.writerow([rank, row["line_no"], row["code"], row["hits"], f"{row['wall']:.3f}",
+                                     f"{row['average']:.3f}", f"{row['motion']:.3f}", f"{row['wait']:.3f}",
+                                     f"{row['other']:.3f}", f"{row['percent']:.1f}", "是" if row["hot"] else ""])
+            print(f"剖析報告已匯出（{profiler.runs} 次執行）: {file_path}")
+            messagebox.showinfo("提示", f"剖析報告已匯出到: {file_path}")
+        except Exception as e:
+            messagebox.showerror("錯誤", f"無法匯出剖析報告: {e}")
+
+    def start_recorder(self):
+        # 建立本次執行的紀錄檔並開始定時取樣
+        try:
+            os.makedirs(RECORD_DIR, exist_ok=True)
+            file_path = os.path.join(RECORD_DIR, time.strftime("record_%Y%m%d_%H%M%S.c3ts"))
+            io_names = {bit: name for name, bit in self.io_bit_numbers.items()}
+            self.recorder = TimeSeriesRecorder(file_path, io_names)
+            print(f"時序紀錄已啟動: {file_path}")
+        except OSError as e:
+            print(f"無法建立紀錄檔: {e}")
+            return
+        self.root.after(RECORD_INTERVAL_MS, self.record_sample)
+
+    def current_io_bits(self):
+        # 將 I/O 狀態組成位元向量（位元編號見 io_bit_number）
+        io_bits = 0
+        for components, name, bit in self.io_bit_table:
+            if components[name]:
+                io_bits |= bit
+        return io_bits
+
+    def record_sample(self):
+        # 取樣當前坐標與 I/O 位元
+        if self.recorder is None or self.recorder.file is None:
+            return
+        coords = self.coords
+        try:
+            self.recorder.sample(time.time(), coords["X"], coords["Y"], coords["Z"], coords["C"], self.current_io_bits())
+        except OSError as e:
+            print(f"時序紀錄寫入失敗，停止紀錄: {e}")
+            self.recorder = None
+            return
+        self.root.after(RECORD_INTERVAL_MS, self.record_sample)
+
+    def export_record(self):
+        # 匯出最近一段時間的時序紀錄為 CSV
+        if self.recorder is None:
+            messagebox.showwarning("警告", "時序紀錄未啟動!")
+            return
+        minutes = simpledialog.askfloat("匯出紀錄", "匯出最近幾分鐘的紀錄:", initialvalue=10.0, minvalue=0.0, parent=self.root)
+        if minutes is None:
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+        if not file_path:
+            return
+        end_time = time.time()
+        try:
+            count = self.recorder.export_csv(file_path, end_time - minutes * 60, end_time)
+            print(f"已匯出 {count} 筆紀錄: {file_path}")
+            messagebox.showinfo("提示", f"已匯出 {count} 筆紀錄到: {file_path}")
+        except Exception as e:
+            messagebox.showerror("錯誤", f"無法匯出紀錄: {e}")
 
     def update_progress(self):
         # 更新進度顯示
         self.progress_label.config(text=f"進度: {self.current_line}/{self.total_lines}")
+        self.publish_state()
+
+    def start_state_block(self):
+        # 建立共享記憶體並發布初始狀態
+        try:
+            self.state_block = MachineStateBlock()
+            print(f"機台狀態共享記憶體已建立: {SHARED_STATE_NAME}")
+            # 位元編號超出共享記憶體 I/O 欄位的元件無法發布
+            overflow = sorted(name for name, bit in self.io_bit_numbers.items() if bit >= SHARED_STATE_IO_BITS)
+            if overflow:
+                names = ", ".join(overflow[:10])
+                print(f"以下 I/O 的編號超出共享記憶體範圍 (0~{SHARED_STATE_IO_BITS // 2 - 1})，不會發布: {names}")
+                messagebox.showwarning("警告", f"以下 I/O 的編號超出共享記憶體範圍 (0~{SHARED_STATE_IO_BITS // 2 - 1})，"
+                                              f"不會發布到機台狀態: {names}")
+        except FileExistsError as e:
+            # 另一個控制程式正在發布狀態，本程式不發布
+            print(f"無法建立機台狀態共享記憶體: {e}")
+            messagebox.showwarning("警告", f"{e}\n本程式將不發布機台狀態。")
+            return
+        except OSError as e:
+            print(f"無法建立機台狀態共享記憶體: {e}")
+            return
+        self.publish_state()
+
+    def publish_state(self):
+        # 將坐標、運行狀態、進度和 I/O 位元發布到共享記憶體
+        if self.state_block is None:
+            return
+        run_state = 0 if not self.is_running else (2 if self.is_paused else 1)
+        self.state_block.publish([self.coords[axis] for axis in AXES], run_state,
+                                 0 if self.operation_mode == "手動" else 1,
+                                 0 if self.execution_mode == "連續" else 1,
+                                 self.current_line, self.total_lines, self.current_io_bits())
 
     def stop_machine(self):
         if self.operation_mode != "自動":
             return
+        self.cancel_execution()
         self.is_running = False
+        self.abort_motion()
+        self.vm = None
+        self.current_action = None
+        self.interrupted_action = None
+        if self.profiler is not None:
+            self.profiler.finish_run()
+            self.profiler = None
+            self.draw_profile_gutter()
         self.is_paused = False
         self.current_line = 0
         self.total_lines = 0
@@ -874,7 +3180,11 @@ if __name__ == "__main__":
     try:
         root = tk.Tk()
         app = CNCControlInterface(root)
-        root.mainloop()
+        try:
+            root.mainloop()
+        except KeyboardInterrupt:
+            # Ctrl+C 結束時仍寫入紀錄檔並釋放共享記憶體
+            app.close_program()
     except tk.TclError as e:
         print(f"無法啟動圖形介面: {e}")
         print("請確保環境支援圖形顯示 (例如設置 $DISPLAY 變數或在本地電腦運行)。")
\ No newline at end of file